@@ -1,34 +1,40 @@
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
-import cv2
 import functools
+import itertools
 import time
 
 # Import custom scripts
-import config.db_config as db
 import config.vector_db_config as vdb
 import scripts.handle_files as hfiles
 import scripts.extract_text as etxt
 import scripts.extract_tables as etables
 import scripts.extract_figures as efigs
+import scripts.table_data as tdata
+import scripts.chunking as chunking
+import scripts.pipeline as pipeline
+import scripts.jobs as jobs
+import config.model_registry as models
+import config.metrics as metrics
 
 print("Streamlit app running...")
 st.set_page_config(layout="wide")
 
 os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
 
-# Folder structure setup
-BASE_DIR = "upload"
-DIRECTORIES = ["files", "res", "img/pages", "img/annotated", "img/texts", "img/tables", "img/figures"]
-for dir in DIRECTORIES:
-    os.makedirs(os.path.join(BASE_DIR, dir), exist_ok=True)
+# Load the models in the background once per process, the first page renders without waiting
+@st.cache_resource
+def warm_up_models():
+    return models.warm_up(["yolo", "nlp", "vector_store"])
 
-# clear the directories if they are not empty
-def clear_directories():
-    for directory in DIRECTORIES:
-        dir = f'{BASE_DIR}/{directory}'
-        for file in os.listdir(dir):
-            os.remove(f'{dir}/{file}')
+warm_up_models()
+
+# Whether the Streamlit session owning a job is still open, its job is kept while it is
+def session_active(job):
+    owner = job.owner()
+    return bool(owner) and runtime.exists() and runtime.get_instance().is_active_session(owner)
 
 # Initialize session state variables
 if "session_started" not in st.session_state:
@@ -36,12 +42,29 @@ if "session_started" not in st.session_state:
 
 # Initialize the session state variables
 if not st.session_state.session_started:
-    # reset db
-    db.reset_db()
-    
+    # every session works in its own job folder and database schema
+    st.session_state.job = jobs.create_job(owner=get_script_run_ctx().session_id, is_active=session_active)
+
     # set the session state variables
     st.session_state.session_started = True
 
+# the session's job, its files and tables are removed once it goes stale
+job = st.session_state.job
+job.touch()
+
+# the session's metrics, made current again on every rerun
+if "metrics_run" not in st.session_state:
+    st.session_state.metrics_run = metrics.start_run("session", job=job.id)
+metrics.use_run(st.session_state.metrics_run)
+
+# Button callbacks run before the script body, they make the session's run current themselves
+def session_callback(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        metrics.use_run(st.session_state.metrics_run)
+        return fn(*args, **kwargs)
+    return wrapper
+
 if "files_uploaded" not in st.session_state:
     st.session_state.files_uploaded = False
     st.session_state.files_processed = False
@@ -74,16 +97,57 @@ def update_page_state(page):
     elif page == "All Data":
         st.session_state.data_page = True
 
+# Display artifacts as a grid of cached thumbnails, GALLERY_PAGE_SIZE at a time
+GALLERY_PAGE_SIZE = 12
+
+def show_gallery(items, captions, key, columns=3):
+    if not items:
+        return
+    page_count = (len(items) + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+    page = 1
+    if page_count > 1:
+        page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, key=f"{key}_gallery_page")
+    start = (page - 1) * GALLERY_PAGE_SIZE
+    end = min(start + GALLERY_PAGE_SIZE, len(items))
+    columns = min(columns, len(items))
+    for i in range(start, end, columns):
+        cols = st.columns(columns)
+        for j, col in enumerate(cols):
+            if i + j < end:
+                col.image(items[i + j].thumbnail(), caption=captions[i + j], use_container_width=True)
+
+# Breakdown of where the time of the current document went
+def show_metrics():
+    run = metrics.current_run().to_dict()
+    rows = [{"Stage": stage,
+             "Calls": entry["calls"],
+             "Wall (s)": entry["wall_seconds"],
+             "CPU (s)": entry["cpu_seconds"],
+             "Items": ", ".join(f"{n} {item}" for item, n in entry["items"].items()),
+             "Written (KB)": round(entry["bytes_written"] / 1024, 1)}
+            for stage, entry in run["stages"].items()]
+    if rows:
+        st.dataframe(rows, hide_index=True)
+    else:
+        st.write("No stages recorded yet.")
+    if run["peak_rss_bytes"] is not None:
+        st.write(f"Peak memory: {run['peak_rss_bytes'] / 1024 ** 2:.0f} MB")
+    st.write(f"DB pool: {run['gauges']['db_pool']}")
+    if st.button("Save Metrics", key="save_metrics"):
+        metrics.save()
+        st.success(f"Metrics saved to {metrics.METRICS_DIR}")
+
 def upload_new_file():
+    # remove the files of the previous document, the job and its tables stay
+    job.clear_files()
     # destroy all session state variables
     st.session_state.clear()
+    st.session_state.job = job
     st.session_state.session_started = True
 
 # Streamlit UI
 if not st.session_state.files_uploaded:
     print("Files not uploaded")
-    # clear the directories if they are not empty
-    clear_directories()
 
     st.title("📄 ETL Pipeline for Document Processing")
     uploaded_file = st.file_uploader("Upload PDF or Image", type=["pdf", "png", "jpg", "jpeg"])
@@ -91,7 +155,7 @@ if not st.session_state.files_uploaded:
     if uploaded_file:
         # Save the uploaded file
         file_extension = uploaded_file.name.split(".")[-1].lower()
-        save_path = f"upload/files/{uploaded_file.name}"
+        save_path = job.upload_path(uploaded_file.name)
         hfiles.save_uploaded_file(uploaded_file, save_path)
         st.session_state.file_path = save_path
 
@@ -105,19 +169,17 @@ if st.session_state.files_uploaded and not st.session_state.files_processed:
     # retrieve the file path
     save_path = st.session_state.file_path
     
-    # Split the PDF into images
-    if save_path.endswith(".pdf"):
-        page_files = hfiles.split_pdf(save_path)
-    else:
-        page_files = [save_path]
-    st.session_state.page_files = page_files
-
-    # Extract text, tables, and figures and save them to the session state
-    annotated_images, texts, tables, figures = hfiles.detect_text(page_files)
-    st.session_state.annotated_images = annotated_images
-    st.session_state.texts = texts
-    st.session_state.tables = tables
-    st.session_state.figures = figures    
+    # Rasterize, detect and OCR the pages as a pipeline, tables are extracted on request
+    st.session_state.metrics_run = metrics.start_run(os.path.basename(save_path), job=job.id)
+    result = pipeline.process_document(save_path, extract_tables=False)
+    metrics.save()
+    figures = result.figures
+
+    # Save the text, tables, and figures to the session state
+    st.session_state.annotated_images = result.annotated_images
+    st.session_state.texts = result.texts
+    st.session_state.tables = result.tables
+    st.session_state.figures = figures
 
     # initialize text_data session state variable
     if "text_data" not in st.session_state:
@@ -125,15 +187,19 @@ if st.session_state.files_uploaded and not st.session_state.files_processed:
     if "table_name" not in st.session_state:
         st.session_state.table_name = []
     if "table_data" not in st.session_state:
-            st.session_state.table_data = []
+        st.session_state.table_data = []
+        st.session_state.table_text = []
     if "figure_name" not in st.session_state:
         st.session_state.figure_name = [None] * len(figures)
     if "figure_data" not in st.session_state:
         st.session_state.figure_data = [None] * len(figures)
+        st.session_state.figure_text = [""] * len(figures)
         
 
-    # Extract text from the images
-    st.session_state.text_data = etxt.extract_text(texts)
+    # Text extracted from the images, the region texts keep their page and bbox for the vector store
+    st.session_state.text_data = result.text
+    st.session_state.ocr_text = result.text
+    st.session_state.page_blocks = result.page_blocks
 
     # Update session state variables
     st.session_state.files_processed = True
@@ -164,6 +230,10 @@ if st.session_state.files_processed:
     if st.sidebar.button("Upload New File", on_click=upload_new_file, key="upload_new_file"):
         st.write("Upload a new file")
 
+    # sidebar metrics of the current document
+    with st.sidebar.expander("⏱️ Processing Metrics"):
+        show_metrics()
+
 # Display home page
 if st.session_state.files_processed and st.session_state.home_page:
     st.title("📌 Extracted Pages")
@@ -174,26 +244,9 @@ if st.session_state.files_processed and st.session_state.home_page:
     )
     if len(annotated_images) == 0:
         st.write("No pages detected in the document.")
-    elif len(annotated_images) < 3:
-        # loop to display the extracted pages in 3 columns
-        cols = st.columns(len(annotated_images))
-        for i, col in enumerate(cols):
-            # resize the image to fit the container width
-            img = cv2.imread(annotated_images[i])
-            img = cv2.resize(img, (0, 0), fx=0.5, fy=0.5)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            col.image(img, caption=f"Page {i + 1}", use_container_width=True)
     else:
-        # loop to display the extracted pages in 3 columns
-        for i in range(0, len(annotated_images), 3):
-            cols = st.columns(3)
-            for j, col in enumerate(cols):
-                if i + j < len(annotated_images):
-                    # resize the image to fit the container width
-                    img = cv2.imread(annotated_images[i + j])
-                    img = cv2.resize(img, (0, 0), fx=0.5, fy=0.5)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                    col.image(img, caption=f"Page {i + j + 1}", use_container_width=True)
+        # display the extracted pages in 3 columns
+        show_gallery(annotated_images, [f"Page {i + 1}" for i in range(len(annotated_images))], key="pages")
 
 # Text Page
 # functions to process the extracted text
@@ -201,10 +254,11 @@ def process_text(text):
     processed_text = etxt.clean_text(text)
     st.session_state.text_data = processed_text
 
+@session_callback
 def save_text(editable_text):
     file_path = st.session_state.file_path
     file_name = os.path.basename(file_path)
-    etxt.save_text(file_name, editable_text)
+    etxt.save_text(file_name, editable_text, schema=job.schema)
 
 if st.session_state.files_processed and st.session_state.text_page:
     # Display the extracted text
@@ -220,16 +274,8 @@ if st.session_state.files_processed and st.session_state.text_page:
     # coloumn to display the extracted images
     col1.subheader("🖼️ Extracted Text Images")
     with col1.container(height=600):
-        # loop to display the extracted text images in 3 columns inside a container
-        for i in range(0, len(texts), 3):
-            cols = st.columns(3)
-            for j, col in enumerate(cols):
-                if i + j < len(texts):
-                    # resize the image to fit the container width
-                    img = cv2.imread(texts[i + j])
-                    img = cv2.resize(img, (0, 0), fx=0.5, fy=0.5)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                    col.image(img, caption=f"Text {i + j + 1}", use_container_width=True)
+        # display the extracted text images in 3 columns inside a container
+        show_gallery(texts, [f"Text {i + 1}" for i in range(len(texts))], key="texts")
 
     # coloumn to display the extracted text
     col2_1, col2_2 = col2.columns([1, 1])
@@ -247,7 +293,6 @@ if st.session_state.files_processed and st.session_state.text_page:
     if col2_1.button("Process Text", on_click=lambda: process_text(editable_text), use_container_width=True):
         st.success("Text processed successfully")
 
-    text_file_path = "upload/res/extracted_text.txt"
     if col2_2.button("Save Extracted Text", on_click=lambda: save_text(editable_text), use_container_width=True):
         st.success(f"Text saved in database successfully")
 
@@ -255,32 +300,40 @@ if st.session_state.files_processed and st.session_state.text_page:
 # Extract figures function
 def read_tab_data(i, data_path, name):
     table_name, table_data = etables.read_data(data_path, name)
+    tdata.save_parquet(table_name, table_data, folder=job.res_dir)
     # update the session state
     st.session_state.table_name[i] = table_name
     st.session_state.table_data[i] = table_data
+    st.session_state.table_text[i] = tdata.to_text(table_data)
     # rerun the page
     time.sleep(0.1)  
     st.rerun()
 
 # Extract tables function
+@session_callback
 def extract_tables(tables, implicit_rows, implicit_columns, borderless_tables):
     table_name, table_data = etables.extract_table_data(tables, implicit_rows, implicit_columns, borderless_tables)
+    for name, df in zip(table_name, table_data):
+        tdata.save_parquet(name, df, folder=job.res_dir)
     st.session_state.table_name = table_name
     st.session_state.table_data = table_data
+    st.session_state.table_text = [tdata.to_text(df) for df in table_data]
 
 # Delete table function
 def delete_table(i):
     # delete table from the file system
     table_path = st.session_state.table_name[i]
-    etables.delete_table(table_path)
+    etables.delete_table(table_path, folder=job.res_dir)
     # delete table from session state
     st.session_state.tables.pop(i)
     st.session_state.table_name.pop(i)
     st.session_state.table_data.pop(i)
+    st.session_state.table_text.pop(i)
 
 # Save table function
+@session_callback
 def save_table(table_name, table_data):
-    etables.save_table(table_name, table_data)
+    etables.save_table(table_name, table_data, schema=job.schema)
 
 # display tables page
 if st.session_state.files_processed and st.session_state.table_page:
@@ -311,15 +364,7 @@ if st.session_state.files_processed and st.session_state.table_page:
 
             # Display the extracted tables
             st.subheader("📊 Extracted Tables")
-            for i in range(0, len(tables), 3):
-                cols = st.columns(3)
-                for j, col in enumerate(cols):
-                    if i + j < len(tables):
-                        # resize the image to fit the container width
-                        img = cv2.imread(tables[i + j])
-                        img = cv2.resize(img, (0, 0), fx=0.5, fy=0.5)
-                        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                        col.image(img, caption=os.path.basename(tables[i + j]), use_container_width=True)
+            show_gallery(tables, [table.name for table in tables], key="tables")
         else:
             # Display the extracted tables
             st.subheader("📊 Extracted Tables")
@@ -327,6 +372,7 @@ if st.session_state.files_processed and st.session_state.table_page:
             upploaded_table_path = [None] * len(figures)
             table_name = [None] * len(tables)
             editable_table = [None] * len(tables)
+            table_text = [""] * len(tables)
             csv_name = [None] * len(tables)
             csv_table = [None] * len(tables)
 
@@ -334,7 +380,7 @@ if st.session_state.files_processed and st.session_state.table_page:
                 # container to display the extracted table images and data
                 with st.container(border=True):
                     col1, col2 = st.columns([3, 2])
-                    col1.image(table, caption=f"Table {i + 1}", use_container_width=True)
+                    col1.image(table.image, channels="BGR", caption=f"Table {i + 1}", use_container_width=True)
 
                     # col2 to display the extracted table data
                     # col2 to display the extracted figure data
@@ -344,7 +390,7 @@ if st.session_state.files_processed and st.session_state.table_page:
                     if uploaded_tab_data[i]:
                         # Save the uploaded file
                         file_extension = uploaded_tab_data[i].name.split(".")[-1].lower()
-                        save_path = f"upload/files/{uploaded_tab_data[i].name}"
+                        save_path = job.upload_path(uploaded_tab_data[i].name)
                         hfiles.save_uploaded_file(uploaded_tab_data[i], save_path)
                         upploaded_table_path[i] = save_path
                         # button to read the uploaded data
@@ -356,11 +402,16 @@ if st.session_state.files_processed and st.session_state.table_page:
                                 st.warning("Please upload a file first!")
 
                     table_name[i] = col2.text_input("Table Name", st.session_state.table_name[i], key=f"Table_{i+1}_Name", max_chars=63)
-                    if len(st.session_state.table_data[i]) > 0:
-                        table_data = st.session_state.table_data[i]
-                        editable_table[i] = col2.text_area("Edit the extracted table", table_data, height=400, key=f"Table_{i+1}_Data")
-                    else:
-                        editable_table[i] = col2.text_area("Edit the extracted table", "", height=400, key=f"Table_{i+1}_Data")
+                    # the text view is derived from the table, edits are parsed once
+                    table_text[i] = st.session_state.table_text[i]
+                    editable_table[i] = st.session_state.table_data[i]
+                    edited_text = col2.text_area("Edit the extracted table (CSV)", table_text[i], height=400, key=f"Table_{i+1}_Data")
+                    try:
+                        editable_table[i], table_text[i] = tdata.apply_edit(editable_table[i], table_text[i], edited_text)
+                        if edited_text != st.session_state.table_text[i]:
+                            tdata.save_parquet(table_name[i], editable_table[i], folder=job.res_dir)
+                    except ValueError as e:
+                        col2.error(f"Could not parse the table: {e}")
 
                     # Buttons
                     col2_1, col2_2, col2_3 = col2.columns([1, 1, 1])
@@ -377,19 +428,19 @@ if st.session_state.files_processed and st.session_state.table_page:
             # Save the table data to the session state
             st.session_state.table_name = table_name
             st.session_state.table_data = editable_table
+            st.session_state.table_text = table_text
 
 # Figures Page
 # Read figure data function
 def read_fig_data(i, data_path, name):
     figure_name, figure_data = efigs.read_data(data_path, name)
+    tdata.save_parquet(figure_name, figure_data, folder=job.res_dir)
     # rename figure image
-    figure_path = st.session_state.figures[i]
-    new_path = f"upload/img/figures/{figure_name}.png"
-    os.rename(figure_path, new_path)
+    st.session_state.figures[i].name = figure_name
     # update the session state
     st.session_state.figure_name[i] = figure_name
     st.session_state.figure_data[i] = figure_data
-    st.session_state.figures[i] = new_path
+    st.session_state.figure_text[i] = tdata.to_text(figure_data)
     # rerun the page
     time.sleep(0.1)  
     st.rerun()
@@ -400,10 +451,12 @@ def delete_figure(i):
     st.session_state.figures.pop(i)
     st.session_state.figure_name.pop(i)
     st.session_state.figure_data.pop(i)
+    st.session_state.figure_text.pop(i)
 
 # Save table function
+@session_callback
 def save_figure(figure_name, figure_df):
-    efigs.save_figure(figure_name, figure_df)
+    efigs.save_figure(figure_name, figure_df, schema=job.schema)
 
 # display figures page
 if st.session_state.files_processed and st.session_state.figure_page:
@@ -421,14 +474,15 @@ if st.session_state.files_processed and st.session_state.figure_page:
         uploaded_fig_data = [False] * len(figures)
         figure_data_path = [None] * len(figures)
         figure_data = [None] * len(figures)
+        figure_text = [""] * len(figures)
         st.subheader("🖼️ Extracted Figures")
         for i, figure in enumerate(figures):
-            figure_name[i] = os.path.basename(figure).split(".")[0]
+            figure_name[i] = figure.name
             figure_data[i] = st.session_state.figure_data[i]
             # container to display the extracted figure images and text_area data
             with st.container(border=True):
                 col1, col2 = st.columns([3, 2])
-                col1.image(figure, caption=f"Figure {i + 1}", use_container_width=True)
+                col1.image(figure.image, channels="BGR", caption=f"Figure {i + 1}", use_container_width=True)
 
                 # col2 to display the extracted figure data
                 col2_1, col2_2 = col2.columns([3, 1], vertical_alignment="center")
@@ -438,7 +492,7 @@ if st.session_state.files_processed and st.session_state.figure_page:
                 if uploaded_fig_data[i]:
                     # Save the uploaded file
                     file_extension = uploaded_fig_data[i].name.split(".")[-1].lower()
-                    save_path = f"upload/files/{uploaded_fig_data[i].name}"
+                    save_path = job.upload_path(uploaded_fig_data[i].name)
                     hfiles.save_uploaded_file(uploaded_fig_data[i], save_path)
                     figure_data_path[i] = save_path
                     # button to read the uploaded data
@@ -452,15 +506,22 @@ if st.session_state.files_processed and st.session_state.figure_page:
 
                 # text_area to input the extracted figure data
                 figure_name[i] = col2.text_input("Figure Name", value=st.session_state.figure_name[i] if st.session_state.figure_name[i] else "", key=f"Figure_{i+1}_Name")
-                # figure_data[i] = st.session_state.figure_data[i]
-                figure_data[i] = col2.text_area("Edit the extracted figure data", st.session_state.figure_data[i], height=400, key=f"Figure_{i+1}_Data")
+                # the text view is derived from the figure data, edits are parsed once
+                figure_text[i] = st.session_state.figure_text[i]
+                edited_text = col2.text_area("Edit the extracted figure data (CSV)", figure_text[i], height=400, key=f"Figure_{i+1}_Data")
+                try:
+                    figure_data[i], figure_text[i] = tdata.apply_edit(figure_data[i], figure_text[i], edited_text)
+                    if edited_text != st.session_state.figure_text[i]:
+                        tdata.save_parquet(figure_name[i] or figure.name, figure_data[i], folder=job.res_dir)
+                except ValueError as e:
+                    col2.error(f"Could not parse the figure data: {e}")
                 # Buttons
                 col2_1, col2_2, col2_3 = col2.columns([1, 1, 1])
                 # buttons to delete figures with confirmation
                 if col2_1.button("Delete Figure", on_click=functools.partial(delete_figure, i), key=f"Figure_{i+1}_Delete", use_container_width=True):
                     st.success(f"Figure deleted successfully")
                 # buttons to download the images
-                col2_2.download_button(label="Download Figure", data=open(figure, 'rb').read(), file_name=f"Figure_{i+1}.png", mime="image/png", key=f"Figure_{i+1}_Download", use_container_width=True)
+                col2_2.download_button(label="Download Figure", data=figure.to_bytes(), file_name=f"Figure_{i+1}.png", mime="image/png", key=f"Figure_{i+1}_Download", use_container_width=True)
                 # buttons to save the extracted figures to database
                 if col2_3.button("Save Data", on_click=functools.partial(save_figure, figure_name[i], figure_data[i]), key=f"Figure_{i+1}_Save", use_container_width=True):
                     st.success(f"Figure {figure_name[i]} saved successfully")
@@ -468,34 +529,35 @@ if st.session_state.files_processed and st.session_state.figure_page:
         # Save the figure data to the session state
         st.session_state.figure_name = figure_name
         st.session_state.figure_data = figure_data
+        st.session_state.figure_text = figure_text
 
 # All Data Page
-# Combine all extracted data into one string
-def combine_all_data():
-    text_data = st.session_state.text_data
-    table_data = st.session_state.table_data
-    figure_data = st.session_state.figure_data
-    all_data = f"{text_data}\n\n"
-    for table in table_data:
-        all_data += f"{table}\n\n"
-    for figure in figure_data:
-        all_data += f"{figure}\n\n"
-    return all_data
-
-# Save the combined data to the database
+# Chunks of the text regions, table rows and figure data with their page and bbox
+def vector_chunks():
+    if st.session_state.text_data == st.session_state.ocr_text:
+        segments = chunking.page_segments(st.session_state.texts, st.session_state.page_blocks)
+    else:
+        # the text was edited or cleaned, the regions it came from are no longer known
+        segments = chunking.text_segments(st.session_state.text_data)
+    segments = itertools.chain(
+        segments,
+        chunking.table_segments(st.session_state.tables, st.session_state.table_data),
+        chunking.table_segments(st.session_state.figures, st.session_state.figure_data, region_type="figure"))
+    return chunking.iter_chunks(segments)
+
+# Save the chunks to the vector database
+@session_callback
 def save_vector_data():
-    all_data = combine_all_data()
-    title = os.path.basename(st.session_state.file_path)
-    vdb.add_data_to_vector_store(title, all_data)
+    vdb.add_chunks_to_vector_store(vdb.document_key(st.session_state.file_path), vector_chunks())
+    metrics.save()
     st.session_state.vector_data_saved = True
     # rerun the page
     time.sleep(0.1)  
     st.rerun()
 
 # Similarity search
-def search_data(search_text):
-    file_name = os.path.basename(st.session_state.file_path)
-    results = vdb.query_vector_store(query=search_text)
+def search_data(search_text, region_types=None, mode="hybrid"):
+    results = vdb.query_vector_store(query=search_text, region_types=region_types, mode=mode)
     return results
 
 # Display all data
@@ -522,16 +584,19 @@ if st.session_state.files_processed and st.session_state.data_page:
         for i, table in enumerate(st.session_state.table_data):
             table_name, table_data = etables.process_table_data(st.session_state.table_name[i], table)
             st.write(table_name)
-            st.table(table_data)
+            if table_data is not None:
+                st.table(table_data)
+            else:
+                st.write("No data available")
 
     with col3.container(height=600):
         st.subheader("🖼️ Extracted Figures")
         for i, figure in enumerate(st.session_state.figure_data):
-            try:
-                figure_name, figure_data = efigs.process_figure_data(st.session_state.figure_name[i], figure)
-                st.write(figure_name)
+            figure_name, figure_data = efigs.process_figure_data(st.session_state.figure_name[i] or "", figure)
+            st.write(figure_name)
+            if figure_data is not None:
                 st.write(figure_data)
-            except:
+            else:
                 st.write("No data available")
 
     # Buttons to save the extracted data to vector database
@@ -542,16 +607,19 @@ if st.session_state.files_processed and st.session_state.data_page:
     if st.session_state.vector_data_saved:
         st.subheader("🔍 Similarity Search")
         search_text = st.text_input("Search Text", "")
+        region_types = st.multiselect("Search In", ["text", "table", "figure"], placeholder="Everything")
+        # lexical matches exact words and codes without calling the embedding API
+        search_mode = st.radio("Search Mode", ["hybrid", "vector", "lexical"], horizontal=True)
         if st.button("Search", key="search"):
             # Perform similarity search
-            results = search_data(search_text)
+            results = search_data(search_text, region_types, search_mode)
             if len(results) == 0:
                 st.write("No similar data found.")
             else:
                 st.write("Similar data found:")
                 for i, (res, score) in enumerate(results):
                     with st.container(border=True):
-                        st.write(f"Result {i+1}, Similarity Score: {score}")
+                        st.write(f"Result {i+1}, {'Distance' if search_mode == 'vector' else 'Score'}: {score}")
                         st.write(f"{res.page_content}")
                         st.write(f"{res.metadata}")
 
@@ -0,0 +1,74 @@
+"""Rows/sec of the table and text chunk loaders against the local Postgres.
+
+Uses the DB_* settings from .env and writes to throwaway bench_* tables.
+Run from the project root:
+    python -m benchmarks.bench_db_load --rows 50000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import config.db_config as db
+
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "name": [f"item {i}" for i in range(rows)],
+        "value": rng.random(rows).round(2),
+        "count": rng.integers(0, 1000, rows),
+        "note": rng.choice(["None", "a  b", "x, y", "quoted \"text\""], rows),
+    })
+
+
+def bench_to_sql(df, method):
+    table_name = f"bench_to_sql_{method or 'default'}"
+    db.drop_table(table_name)
+    df.head(0).to_sql(table_name, db.get_engine(), index=False)
+    start = time.perf_counter()
+    df.to_sql(table_name, db.get_engine(), if_exists="append", index=False,
+              method=db.copy_insert if method == "copy" else method)
+    elapsed = time.perf_counter() - start
+    db.drop_table(table_name)
+    return elapsed
+
+
+def bench_chunks(rows, use_copy):
+    chunks = [(1, i, f"chunk {i} " * 20) for i in range(rows)]
+    with db.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_chunks")
+            cursor.execute("CREATE TABLE bench_chunks (id SERIAL PRIMARY KEY, texts_id INTEGER, chunk_order INTEGER, content TEXT)")
+    start = time.perf_counter()
+    with db.connection() as connection:
+        with connection.cursor() as cursor:
+            if use_copy:
+                db.copy_rows(cursor, "bench_chunks", ["texts_id", "chunk_order", "content"], chunks)
+            else:
+                for chunk in chunks:
+                    cursor.execute("INSERT INTO bench_chunks (texts_id, chunk_order, content) VALUES (%s, %s, %s)", chunk)
+    elapsed = time.perf_counter() - start
+    db.drop_table("bench_chunks")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    print(f"{args.rows} rows")
+    print(f"{'loader':<24} {'seconds':>10} {'rows/sec':>12}")
+    for label, method in [("to_sql default", None), ("to_sql multi", "multi"), ("to_sql COPY", "copy")]:
+        elapsed = bench_to_sql(df, method)
+        print(f"{label:<24} {elapsed:>10.2f} {args.rows / elapsed:>12.0f}")
+    for label, use_copy in [("chunks INSERT per row", False), ("chunks COPY", True)]:
+        elapsed = bench_chunks(args.rows, use_copy)
+        print(f"{label:<24} {elapsed:>10.2f} {args.rows / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
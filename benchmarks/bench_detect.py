@@ -0,0 +1,45 @@
+"""Pages/sec of the batched YOLO layout detection on CPU.
+
+Run from the project root:
+    python -m benchmarks.bench_detect "AR for improved learnability.pdf" --batch-sizes 1 4 8 16
+"""
+import argparse
+import time
+
+import scripts.handle_files as hfiles
+from scripts.artifacts import load_image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", help="PDF to rasterize and run detection on")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--max-pages", type=int, default=32)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # rasterize once so only detection is timed
+    pages = []
+    for page in hfiles.iter_pdf_pages(args.pdf, dpi=args.dpi, paths_only=False):
+        pages.append(load_image(page))
+        if len(pages) == args.max_pages:
+            break
+
+    # warm up the model so the first batch size does not pay for it
+    list(hfiles.detect_layout(pages[:1], batch_size=1, device="cpu"))
+
+    print(f"{len(pages)} pages at {args.dpi} DPI, best of {args.repeat}")
+    print(f"{'batch':>6} {'seconds':>10} {'pages/sec':>10}")
+    for batch_size in args.batch_sizes:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for _ in hfiles.detect_layout(pages, batch_size=batch_size, device="cpu"):
+                pass
+            best = min(best, time.perf_counter() - start)
+        print(f"{batch_size:>6} {best:>10.2f} {len(pages) / best:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
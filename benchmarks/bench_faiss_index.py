@@ -0,0 +1,126 @@
+"""Recall@k, query latency and size of the FAISS index types against the flat baseline.
+
+Uses clustered random vectors of the embedding dimension, so no API calls
+are made. --truncate also indexes prefixes of the vectors and --rerank-factor
+re-ranks the candidates of compressed indexes with the full vectors, as the
+vector store does. Random vectors are not trained like text-embedding-3, so
+their prefixes lose more recall than real embeddings; --store measures the
+vectors of an existing vector store instead, a sample of them are the queries.
+Run from the project root:
+    python -m benchmarks.bench_faiss_index --vectors 50000 --dim 3072 --k 5
+    python -m benchmarks.bench_faiss_index --store faiss_vector_store --types flat sq8 pq --truncate 0 256 1024
+"""
+import os
+import argparse
+import time
+
+import numpy as np
+
+import config.faiss_index as findex
+
+
+def make_vectors(n, dim, clusters, rng):
+    # embeddings are far from uniform, clustered data gives realistic IVF behaviour
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def store_vectors(path, queries, rng):
+    """Full precision vectors of a saved vector store, split into (vectors, queries)."""
+    index = findex.faiss.read_index(os.path.join(path, "index.faiss"))
+    full_path = os.path.join(path, "full_vectors.f32")
+    if os.path.exists(full_path):
+        dim = os.path.getsize(full_path) // (4 * index.ntotal)
+        vectors = np.fromfile(full_path, dtype=np.float32).reshape(-1, dim)
+    else:
+        vectors = findex.index_vectors(index)
+    picked = rng.choice(len(vectors), min(queries, len(vectors) // 10), replace=False)
+    return np.delete(vectors, picked, axis=0), vectors[picked]
+
+
+def query_latencies(index, queries, k, full_vectors=None, rerank_factor=0):
+    latencies = []
+    ids = []
+    for query in queries:
+        start = time.perf_counter()
+        if full_vectors is None:
+            _, found = index.search(findex.truncate_vectors(query, index.d)[None, :], k)
+            found = found[0]
+        else:
+            _, candidates = index.search(findex.truncate_vectors(query, index.d)[None, :], k * rerank_factor)
+            candidates = candidates[0][candidates[0] >= 0]
+            found, _ = findex.rerank(query, candidates, full_vectors[candidates], k)
+        latencies.append(time.perf_counter() - start)
+        ids.append(found)
+    return np.array(latencies) * 1000, ids
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / sum(len(t) for t in truth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--types", nargs="+", default=findex.INDEX_TYPES, choices=findex.INDEX_TYPES)
+    parser.add_argument("--nprobe", type=int, default=findex.FAISS_NPROBE)
+    parser.add_argument("--ef-search", type=int, default=findex.FAISS_EF_SEARCH)
+    parser.add_argument("--truncate", type=int, nargs="+", default=[0],
+                        help="indexed prefix lengths, 0 indexes the whole vectors")
+    parser.add_argument("--rerank-factor", type=int, default=4,
+                        help="candidates per result re-ranked for compressed indexes, 0 skips re-ranking")
+    parser.add_argument("--store", help="vector store folder to take the vectors from")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.store:
+        vectors, queries = store_vectors(args.store, args.queries, rng)
+    else:
+        vectors = make_vectors(args.vectors, args.dim, args.clusters, rng)
+        queries = make_vectors(args.queries, args.dim, args.clusters, rng)
+    dim = vectors.shape[1]
+
+    print(f"{len(vectors)} vectors x {dim} dims, {len(queries)} queries, k={args.k}")
+    print(f"{'index':<10} {'dims':>5} {'rerank':>6} {'build s':>9} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'MB':>9} {'saved':>6}")
+    truth = None
+    flat_mb = None
+    for truncate in sorted({t if 0 < t < dim else dim for t in args.truncate}, reverse=True):
+        indexed = findex.truncate_vectors(vectors, truncate)
+        for index_type in ["flat"] + [t for t in args.types if t != "flat"]:
+            if truncate < dim and index_type == "flat" and "flat" not in args.types:
+                continue
+            if len(vectors) < findex.min_training_vectors(index_type):
+                print(f"{index_type:<10} {truncate:>5} skipped, too few vectors to train")
+                continue
+            start = time.perf_counter()
+            index = findex.build_index(index_type, truncate, indexed)
+            index.add(indexed)
+            findex.set_search_params(index, nprobe=args.nprobe, ef_search=args.ef_search)
+            build = time.perf_counter() - start
+            size_mb = len(findex.faiss.serialize_index(index)) / 1e6
+            if flat_mb is None:
+                flat_mb = size_mb
+
+            compressed = truncate < dim or index_type in findex.LOSSY_TYPES
+            for rerank_factor in [0, args.rerank_factor] if compressed and args.rerank_factor else [0]:
+                latencies, found = query_latencies(index, queries, args.k,
+                                                   vectors if rerank_factor else None, rerank_factor)
+                if truth is None:
+                    truth = found
+                print(f"{index_type:<10} {truncate:>5} {rerank_factor or '-':>6} {build:>9.2f} "
+                      f"{recall_at_k(found, truth):>9.3f} {np.percentile(latencies, 50):>8.3f} "
+                      f"{np.percentile(latencies, 99):>8.3f} {size_mb:>9.1f} {1 - size_mb / flat_mb:>6.0%}")
+    if args.rerank_factor:
+        # re-ranking reads rows of the full vectors file, which stays on disk
+        print(f"Re-ranking keeps {vectors.nbytes / 1e6:.1f} MB of full precision vectors on disk")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Import time of the project modules, each measured in a fresh interpreter.
+
+Uses `python -X importtime` and reports the total per module plus the slowest
+imports it pulls in. Run from the project root:
+    python -m benchmarks.profile_imports --top 10
+"""
+import argparse
+import subprocess
+import sys
+
+MODULES = [
+    "config.db_config",
+    "config.vector_db_config",
+    "scripts.handle_files",
+    "scripts.extract_text",
+    "scripts.extract_tables",
+    "scripts.extract_figures",
+]
+
+
+def profile(module):
+    """Returns (total seconds, [(cumulative seconds, imported package)])."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        imports.append((int(cumulative) / 1e6, name))
+    own = [item for item in imports if item[1] == module]
+    total = own[-1][0] if own else sum(seconds for seconds, _ in imports)
+    return total, sorted(imports, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to list per module")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        try:
+            total, imports = profile(module)
+        except RuntimeError as e:
+            print(f"{module:<28} failed: {e}")
+            continue
+        print(f"{module:<28} {total:>7.3f}s")
+        for seconds, name in [item for item in imports if item[1] != module][:args.top]:
+            print(f"    {seconds:>7.3f}s  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Offline benchmark of every pipeline stage on synthetic documents.
+
+YOLO, Tesseract, img2table and the OpenAI embeddings are replaced by the
+deterministic stubs in benchmarks.stubs, so the suite needs no network, GPU
+or model files and measures the pipeline code itself. Poppler is still used
+for rasterization. Each stage is run --repeat times per page count and the
+median is kept.
+
+Results are written to benchmarks/results/<commit>.json. With --baseline the
+medians are compared to an earlier result and the run fails when a stage got
+slower by more than --threshold (and by more than --min-delta seconds, so
+very fast stages do not flap).
+
+Run from the project root:
+    python -m benchmarks.run_suite --pages 4 16
+    python -m benchmarks.run_suite --pages 4 16 --baseline benchmarks/results/<commit>.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+STAGES = ["rasterize", "detect_text", "ocr", "tables", "chunking", "faiss_add", "faiss_query", "lexical_query",
+          "pipeline"]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def fresh_vector_store(vdb, models):
+    # every repeat starts from an empty store in the working directory
+    shutil.rmtree("faiss_vector_store", ignore_errors=True)
+    models.set_instance("vector_store", vdb.load_vector_store())
+
+
+def run_once(pdf, args):
+    """Returns {stage: seconds} of one pass over the document."""
+    import config.model_registry as models
+    import config.vector_db_config as vdb
+    import scripts.extract_tables as etables
+    import scripts.extract_text as etxt
+    import scripts.handle_files as hfiles
+    import scripts.chunking as chunking
+    import scripts.pipeline as pipeline
+
+    times = {}
+    times["rasterize"], pages = timed(lambda: list(hfiles.iter_pdf_pages(pdf, dpi=args.dpi, paths_only=False)))
+    times["detect_text"], (_, texts, tables, _) = timed(lambda: hfiles.detect_text(pages))
+    times["ocr"], text = timed(lambda: etxt.extract_text(texts, workers=args.ocr_workers))
+    times["tables"], (_, table_data) = timed(
+        lambda: etables.extract_table_data(tables, False, False, False, workers=args.table_workers))
+    times["chunking"], chunks = timed(lambda: list(chunking.iter_chunks(itertools.chain(
+        chunking.text_segments(text), chunking.table_segments(tables, table_data)))))
+
+    fresh_vector_store(vdb, models)
+    times["faiss_add"], _ = timed(lambda: vdb.add_chunks_to_vector_store(os.path.basename(pdf), chunks))
+    queries = [f"{word} of the document" for word in text.split()[:args.queries]]
+    times["faiss_query"], _ = timed(lambda: [vdb.query_vector_store(query, k=5) for query in queries])
+    times["lexical_query"], _ = timed(lambda: [vdb.query_vector_store(query, k=5, mode="lexical")
+                                               for query in queries])
+
+    times["pipeline"], _ = timed(lambda: pipeline.process_document(pdf, dpi=args.dpi,
+                                                                   ocr_workers=args.ocr_workers,
+                                                                   table_workers=args.table_workers))
+    return times
+
+
+def run_suite(args):
+    from benchmarks import synthetic
+
+    results = {}
+    for page_count in args.pages:
+        pdf = synthetic.make_pdf(f"synthetic_{page_count}.pdf", page_count, seed=args.seed)
+        runs = [run_once(pdf, args) for _ in range(args.repeat)]
+        results[str(page_count)] = {stage: {"median": round(statistics.median(run[stage] for run in runs), 4),
+                                            "min": round(min(run[stage] for run in runs), 4)}
+                                    for stage in STAGES}
+        print(f"{page_count} pages")
+        for stage in STAGES:
+            print(f"  {stage:<13} {results[str(page_count)][stage]['median']:>9.3f}s")
+    return results
+
+
+def compare(current, baseline, threshold, min_delta):
+    """Returns the regressions as (pages, stage, baseline seconds, current seconds)."""
+    regressions = []
+    for pages, stages in current["results"].items():
+        for stage, timing in stages.items():
+            before = baseline["results"].get(pages, {}).get(stage)
+            if before is None:
+                continue
+            delta = timing["median"] - before["median"]
+            if delta > min_delta and timing["median"] > before["median"] * (1 + threshold):
+                regressions.append((pages, stage, before["median"], timing["median"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[4, 16], help="page counts of the documents")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--ocr-workers", type=int, default=1)
+    parser.add_argument("--table-workers", type=int, default=1)
+    parser.add_argument("--baseline", help="earlier result JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns below this many seconds")
+    parser.add_argument("--output", help="result file, default benchmarks/results/<commit>.json")
+    args = parser.parse_args()
+
+    # the stubs and the result cache must not depend on earlier runs or the local setup
+    os.environ["CACHE_ENABLED"] = "0"
+    os.environ["METRICS_ENABLED"] = "0"
+    os.environ["FAISS_INDEX_TYPE"] = "flat"
+    from benchmarks import stubs
+    stubs.install()
+
+    output = os.path.abspath(args.output or os.path.join(RESULTS_DIR, f"{git_commit()}.json"))
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    work_dir = tempfile.mkdtemp(prefix="etl_bench_")
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        results = run_suite(args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    current = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+        "config": {key: getattr(args, key) for key in ["repeat", "dpi", "seed", "queries",
+                                                        "ocr_workers", "table_workers"]},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != current["config"]:
+            print("Warning: the baseline was run with a different configuration")
+        regressions = compare(current, baseline, args.threshold, args.min_delta)
+        for pages, stage, before, after in regressions:
+            print(f"REGRESSION {stage} at {pages} pages: {before:.3f}s -> {after:.3f}s")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {baseline.get('commit', baseline_path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Offline stand-ins for YOLO, Tesseract and img2table used by the benchmark suite.
+
+The stubs are deterministic and do a fixed amount of image work per region,
+so the suite measures the code around the models rather than the models.
+install() swaps them in through the model registry and the module level
+OCR / table functions, OpenAI embeddings are replaced by LocalEmbeddings.
+"""
+import cv2
+import numpy as np
+import pandas as pd
+import supervision as sv
+
+import config.model_registry as models
+from config.embedding_cache import LocalEmbeddings
+from benchmarks.synthetic import WORDS, layout_boxes
+
+CLASS_IDS = {"text": 0, "table": 1, "figure": 2}
+
+
+class StubYOLO:
+    """Reports the synthetic page layout for every image."""
+
+    ckpt_path = None
+
+    def __call__(self, images, conf=0.35, iou=0.7, device=None):
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            names, boxes = layout_boxes(width, height)
+            results.append(sv.Detections(xyxy=boxes,
+                                         confidence=np.ones(len(names), dtype=np.float32),
+                                         class_id=np.array([CLASS_IDS[name] for name in names]),
+                                         data={"class_name": np.array(names)}))
+        return results
+
+
+def _binarize(image):
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+
+
+def stub_ocr(image, config=""):
+    """One word per connected ink blob, picked deterministically from WORDS."""
+    image = np.asarray(image)
+    count, _ = cv2.connectedComponents(_binarize(image))
+    return " ".join(WORDS[i % len(WORDS)] for i in range(count - 1)) + "\n"
+
+
+def _line_count(profile):
+    # number of runs of ruled rows/columns in a projection profile
+    lines = profile > 0.8 * profile.max() if profile.max() else profile > 0
+    return int(np.count_nonzero(lines[1:] & ~lines[:-1]) + lines[0])
+
+
+def stub_extract_table(src, implicit_rows, implicit_columns, borderless_tables):
+    """Finds the ruled grid of a table and returns ("Table", DataFrame) of its size."""
+    if isinstance(src, bytes):
+        image = cv2.imdecode(np.frombuffer(src, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    else:
+        image = cv2.imread(src, cv2.IMREAD_GRAYSCALE)
+    binary = _binarize(image)
+    rows = max(_line_count(binary.sum(axis=1)) - 1, 1)
+    columns = max(_line_count(binary.sum(axis=0)) - 1, 1)
+    data = [[f"{r * columns + c}" for c in range(columns)] for r in range(rows - 1)]
+    return "Table", pd.DataFrame(data, columns=[f"col{c}" for c in range(columns)])
+
+
+def stub_tesseract_version():
+    return "stub"
+
+
+def stub_init_ocr(n_threads=1):
+    """No OCR engine is needed, a module function so process pools can pickle it as initializer."""
+    return None
+
+
+def install(dim=3072):
+    """Swaps the stubs in for the rest of the process."""
+    # importing registers the real factories, which would replace the stubs
+    import config.vector_db_config  # noqa: F401
+    import scripts.extract_text as etxt
+    import scripts.extract_tables as etables
+    import scripts.handle_files  # noqa: F401
+
+    models.set_instance("yolo", StubYOLO())
+    models.set_instance("embeddings", LocalEmbeddings(dim=dim))
+    etxt.ocr_page = stub_ocr
+    etxt._tesseract_version = stub_tesseract_version
+    etables.extract_table = stub_extract_table
+    etables._init_ocr = stub_init_ocr
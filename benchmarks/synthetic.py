@@ -0,0 +1,104 @@
+"""Synthetic multi-page PDFs with text blocks, ruled tables and bar charts.
+
+Every page follows LAYOUT, so the stub layout model in benchmarks.stubs
+can report the regions without looking at the pixels. The content is drawn
+from a seeded random generator and is the same on every run.
+
+Run from the project root to write a document:
+    python -m benchmarks.synthetic synthetic.pdf --pages 16
+"""
+import argparse
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# (class name, left, top, right, bottom) as fractions of the page size
+LAYOUT = [
+    ("text", 0.08, 0.05, 0.92, 0.25),
+    ("table", 0.08, 0.29, 0.92, 0.55),
+    ("figure", 0.15, 0.59, 0.85, 0.84),
+    ("text", 0.08, 0.88, 0.92, 0.96),
+]
+
+WORDS = ("the pipeline extracts text tables and figures from scanned documents using layout detection "
+         "optical character recognition and vector search over the stored chunks of every page").split()
+
+# page size in pixels at the resolution the PDF is written with
+PAGE_SIZE = (850, 1100)
+PAGE_DPI = 100
+
+
+def layout_boxes(width, height):
+    """Returns (class names, xyxy boxes) of LAYOUT on a page of the given size."""
+    names = [name for name, *_ in LAYOUT]
+    boxes = np.array([[left * width, top * height, right * width, bottom * height]
+                      for _, left, top, right, bottom in LAYOUT], dtype=np.float32)
+    return names, boxes
+
+
+def draw_text(draw, box, rng):
+    left, top, right, bottom = box
+    y = top
+    while y + 12 < bottom:
+        line = " ".join(rng.choice(WORDS, size=rng.integers(8, 14)))
+        draw.text((left, y), line[:int((right - left) / 6)], fill=0)
+        y += 16
+
+
+def draw_table(draw, box, rng, rows=6, columns=4):
+    left, top, right, bottom = box
+    row_height = (bottom - top) / rows
+    column_width = (right - left) / columns
+    for r in range(rows + 1):
+        draw.line([(left, top + r * row_height), (right, top + r * row_height)], fill=0, width=2)
+    for c in range(columns + 1):
+        draw.line([(left + c * column_width, top), (left + c * column_width, bottom)], fill=0, width=2)
+    for r in range(rows):
+        for c in range(columns):
+            cell = f"col{c}" if r == 0 else f"{rng.integers(0, 1000)}"
+            draw.text((left + c * column_width + 6, top + r * row_height + 6), cell, fill=0)
+
+
+def draw_chart(draw, box, rng, bars=8):
+    left, top, right, bottom = box
+    draw.line([(left, bottom), (right, bottom)], fill=0, width=2)
+    draw.line([(left, top), (left, bottom)], fill=0, width=2)
+    bar_width = (right - left) / (bars * 1.5)
+    for i in range(bars):
+        x = left + (i * 1.5 + 0.5) * bar_width
+        bar_top = bottom - rng.uniform(0.1, 0.95) * (bottom - top)
+        draw.rectangle([x, bar_top, x + bar_width, bottom], fill=int(rng.integers(60, 180)))
+
+
+def make_page(page, seed=0):
+    rng = np.random.default_rng(seed + page)
+    image = Image.new("L", PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(image)
+    for name, box in zip(*layout_boxes(*PAGE_SIZE)):
+        if name == "text":
+            draw_text(draw, box, rng)
+        elif name == "table":
+            draw_table(draw, box, rng)
+        else:
+            draw_chart(draw, box, rng)
+    return image.convert("RGB")
+
+
+def make_pdf(path, pages, seed=0):
+    images = [make_page(page, seed) for page in range(pages)]
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=PAGE_DPI)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="PDF to write")
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_pdf(args.path, args.pages, args.seed)
+    print(f"Wrote {args.pages} pages to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
 from dotenv import load_dotenv
 import os
+import io
+import csv
+import time
+import threading
+import weakref
+from contextlib import contextmanager
 import psycopg2 
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 import pandas as pd 
 from sqlalchemy import create_engine
+import config.metrics as metrics
 
 load_dotenv()
 
@@ -29,41 +37,189 @@ def initialize_db():
     connection.close()
 
 
-def create_connection():
+# Connection pool settings, DB_POOL_MAX caps the connections of the psycopg2 pool and the engine together
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# share of DB_POOL_MAX kept for the SQLAlchemy engine used by pandas
+DB_ENGINE_POOL_SIZE = int(os.getenv("DB_ENGINE_POOL_SIZE", 0)) or max(DB_POOL_MAX // 4, 1)
+_CONNECTION_POOL_MAX = max(DB_POOL_MAX - DB_ENGINE_POOL_SIZE, 1)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# connections idle for longer than this are pinged before they are handed out
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", 30))
+
+_pool = None
+_engine = None
+_slots = None
+_last_used = weakref.WeakKeyDictionary()
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"checked_out": 0, "checkouts": 0, "waits": 0, "wait_time": 0.0, "reconnects": 0}
+
+def _connect_args(database=None):
+    return dict(host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT"),
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                database=database or os.getenv("DB_NAME"))
+
+# create the process wide pool and engine on first use, returns the pool and its slots
+def _init_pool():
+    global _pool, _engine, _slots
+    with _pool_lock:
+        if _pool is None:
+            try:
+                pool = ThreadedConnectionPool(min(DB_POOL_MIN, _CONNECTION_POOL_MAX), _CONNECTION_POOL_MAX,
+                                              **_connect_args())
+            except psycopg2.OperationalError:
+                initialize_db()
+                pool = ThreadedConnectionPool(min(DB_POOL_MIN, _CONNECTION_POOL_MAX), _CONNECTION_POOL_MAX,
+                                              **_connect_args())
+            _engine = create_engine("postgresql://{}:{}@{}:{}/{}"
+                                    .format(os.getenv("DB_USER"),
+                                            os.getenv("DB_PASSWORD"),
+                                            os.getenv("DB_HOST"),
+                                            os.getenv("DB_PORT"),
+                                            os.getenv("DB_NAME")),
+                                    pool_size=DB_ENGINE_POOL_SIZE,
+                                    max_overflow=0,
+                                    pool_timeout=DB_POOL_TIMEOUT,
+                                    pool_pre_ping=True)
+            _slots = threading.BoundedSemaphore(_CONNECTION_POOL_MAX)
+            _pool = pool
+        return _pool, _slots
+
+# the shared SQLAlchemy engine, used by pandas
+def get_engine():
+    _init_pool()
+    return _engine
+
+@contextmanager
+def connection(schema=None):
+    """Checks out a pooled psycopg2 connection.
+
+    The transaction is committed when the block exits normally and rolled back
+    on error. Waits up to DB_POOL_TIMEOUT seconds when all connections are in use.
+    With `schema` unqualified table names resolve to that schema for the
+    duration of the transaction.
+    """
+    pool, slots = _acquire_slot()
+
+    conn = None
     try:
-        connection = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME")
-        )
-        engine = create_engine("postgresql://{}:{}@{}:{}/{}"
-                               .format(os.getenv("DB_USER"), 
-                                       os.getenv("DB_PASSWORD"), 
-                                       os.getenv("DB_HOST"), 
-                                       os.getenv("DB_PORT"), 
-                                       os.getenv("DB_NAME")))
-        return connection, engine
-    except Exception as e:
-        initialize_db()
-        connection = psycopg2.connect(
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME")
-        )
-        engine = create_engine("postgresql://{}:{}@{}:{}/{}"
-                               .format(os.getenv("DB_USER"), 
-                                       os.getenv("DB_PASSWORD"), 
-                                       os.getenv("DB_HOST"), 
-                                       os.getenv("DB_PORT"), 
-                                       os.getenv("DB_NAME")))
-        return connection, engine
+        conn = _checkout(pool)
+        with _stats_lock:
+            _stats["checked_out"] += 1
+            _stats["checkouts"] += 1
+        try:
+            if schema:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SET LOCAL search_path TO {quote_identifier(schema)}, public")
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            with _stats_lock:
+                _stats["checked_out"] -= 1
+    finally:
+        if conn is not None:
+            _last_used[conn] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+        slots.release()
+
+# wait for a free connection of the current pool
+def _acquire_slot():
+    while True:
+        pool, slots = _init_pool()
+        if not slots.acquire(blocking=False):
+            start = time.perf_counter()
+            acquired = slots.acquire(timeout=DB_POOL_TIMEOUT)
+            with _stats_lock:
+                _stats["waits"] += 1
+                _stats["wait_time"] += time.perf_counter() - start
+            if not acquired:
+                raise PoolError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+        if not pool.closed:
+            return pool, slots
+        # the pool was disposed while waiting, wait on its replacement
+        slots.release()
+
+# get a connection from the pool, replacing the ones that went stale
+def _checkout(pool):
+    # every pooled connection may be stale after a server restart, plus one new connection
+    for _ in range(_CONNECTION_POOL_MAX + 1):
+        conn = pool.getconn()
+        if _healthy(conn):
+            return conn
+        pool.putconn(conn, close=True)
+        with _stats_lock:
+            _stats["reconnects"] += 1
+    raise PoolError("Could not get a working database connection")
+
+# new connections and those idle for DB_POOL_PING_AFTER seconds are pinged
+def _healthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(conn, float("-inf")) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+# pool usage counters for sizing the pool
+def pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["max_connections"] = DB_POOL_MAX
+    stats["connection_pool_size"] = _CONNECTION_POOL_MAX
+    stats["engine_pool_size"] = DB_ENGINE_POOL_SIZE
+    stats["avg_wait_time"] = stats["wait_time"] / stats["waits"] if stats["waits"] else 0.0
+    engine = _engine
+    stats["engine_checked_out"] = engine.pool.checkedout() if engine is not None else 0
+    stats["engine_connections"] = engine.pool.checkedin() + stats["engine_checked_out"] if engine is not None else 0
+    return stats
+
+metrics.register_gauge("db_pool", pool_stats)
+
+# close every pooled connection, the pool is recreated on next use
+def dispose_pool():
+    """Waits up to DB_POOL_TIMEOUT seconds for checked out connections to be
+    returned, new checkouts wait for the next pool meanwhile. Raises PoolError
+    and keeps the pool when they are not returned in time."""
+    global _pool, _engine, _slots
+    with _pool_lock:
+        if _pool is None:
+            return
+        # holding every slot means no connection is checked out
+        deadline = time.monotonic() + DB_POOL_TIMEOUT
+        drained = 0
+        while drained < _CONNECTION_POOL_MAX and _slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            drained += 1
+        if drained < _CONNECTION_POOL_MAX:
+            for _ in range(drained):
+                _slots.release()
+            raise PoolError(f"Database connections still in use after {DB_POOL_TIMEOUT}s")
+        _pool.closeall()
+        _engine.dispose()
+        # threads waiting on the old slots see the closed pool and move to the next one
+        for _ in range(drained):
+            _slots.release()
+        _pool = None
+        _engine = None
+        _slots = None
+        _last_used.clear()
 
 # reset the database
 def reset_db():
+    # Release pooled connections, the database cannot be dropped while in use
+    dispose_pool()
+
     # Connect to 'postgres' instead of the target DB
     connection = psycopg2.connect(
         host=os.getenv("DB_HOST"),
@@ -86,33 +242,78 @@ def reset_db():
     cursor.close()
     connection.close()
 
-    # Reconnect to the newly created database
-    connection, engine = create_connection()
-    return connection, engine
+# Rows sent per COPY statement, bounds the size of the in-memory buffer
+COPY_BATCH_ROWS = 10000
+
+# quote an identifier for use in raw SQL
+def quote_identifier(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+# quoted table name, qualified with its schema if given
+def qualified_name(table_name, schema=None):
+    if schema:
+        return f"{quote_identifier(schema)}.{quote_identifier(table_name)}"
+    return quote_identifier(table_name)
+
+# per job schemas keep the tables of concurrent jobs apart
+def create_schema(schema):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {quote_identifier(schema)}")
+
+def drop_schema(schema):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {quote_identifier(schema)} CASCADE")
+
+# bulk load rows into a table with COPY FROM STDIN
+def copy_rows(cursor, table_name, columns, rows):
+    """Streams an iterable of row tuples into the table in CSV batches."""
+    columns = ", ".join(quote_identifier(column) for column in columns)
+    sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    row_count = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if value is None else value for value in row])
+        row_count += 1
+        if row_count % COPY_BATCH_ROWS == 0:
+            _flush_copy(cursor, sql, buffer)
+    _flush_copy(cursor, sql, buffer)
+    return row_count
+
+def _flush_copy(cursor, sql, buffer):
+    if buffer.tell() == 0:
+        return
+    metrics.count(bytes_written=buffer.tell())
+    buffer.seek(0)
+    cursor.copy_expert(sql, buffer)
+    buffer.seek(0)
+    buffer.truncate()
+
+# pandas to_sql insert method that uses COPY instead of row by row inserts
+def copy_insert(pd_table, conn, keys, data_iter):
+    table_name = quote_identifier(pd_table.name)
+    if pd_table.schema:
+        table_name = f"{quote_identifier(pd_table.schema)}.{table_name}"
+    dbapi_connection = conn.connection
+    with dbapi_connection.cursor() as cursor:
+        return copy_rows(cursor, table_name, keys, data_iter)
 
 # crete a table in from dataframe
-def create_table_from_df(table_name, data):
+@metrics.instrument("create_table_from_df")
+def create_table_from_df(table_name, data, schema=None, if_exists="append"):
+    """Appends to an existing table, if_exists="replace" drops it first."""
     df = pd.DataFrame(data)
-    connection, engine = create_connection()
-    df.to_sql(table_name, engine, if_exists="append", index=False)
-    connection.commit()
-    connection.close()
+    df.to_sql(table_name, get_engine(), schema=schema, if_exists=if_exists, index=False, method=copy_insert)
+    metrics.count(rows=len(df))
 
 # read a table from the database
-def read_table(table_name):
-    connection, engine = create_connection()
-    df = pd.read_sql("SELECT * FROM {}".format(table_name), connection)
-    connection.commit()
-    connection.close()
-    return df
+def read_table(table_name, schema=None):
+    return pd.read_sql("SELECT * FROM {}".format(qualified_name(table_name, schema)), get_engine())
 
 # drop a table from the database
-def drop_table(table_name):
-    connection, engine = create_connection()
-    cursor = connection.cursor()
-    cursor.execute("DROP TABLE IF EXISTS {}".format(table_name))
-    cursor.close()
-    connection.close()
-
-
-    
\ No newline at end of file
+def drop_table(table_name, schema=None):
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS {}".format(qualified_name(table_name, schema)))
@@ -0,0 +1,121 @@
+from dotenv import load_dotenv
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+
+# SQLite limits the number of parameters of a single query
+_LOOKUP_BATCH = 500
+
+# Persistent cache in front of an embedding function
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that stores every vector by model name and text hash.
+
+    Only texts that were never embedded with the same model are sent to the
+    underlying embedding function, duplicates within a call are embedded once.
+    """
+
+    def __init__(self, embeddings, model_name, path=EMBEDDING_CACHE_PATH):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT,
+                    text_hash TEXT,
+                    vector BLOB,
+                    PRIMARY KEY (model, text_hash)
+                )
+            """)
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, hashes):
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start:start + _LOOKUP_BATCH]
+                rows = self._db.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({})"
+                    .format(", ".join("?" * len(batch))),
+                    [self.model_name, *batch],
+                )
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, items):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                 for text_hash, vector in items],
+            )
+
+    def embed_documents(self, texts):
+        hashes = [self.text_hash(text) for text in texts]
+        vectors = self._lookup(hashes)
+
+        # embed each missing text once
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), new_vectors))
+            self._store(new_items)
+            vectors.update((text_hash, list(vector)) for text_hash, vector in new_items)
+
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text):
+        text_hash = self.text_hash(text)
+        vector = self._lookup([text_hash]).get(text_hash)
+        if vector is None:
+            vector = list(self.embeddings.embed_query(text))
+            self._store([(text_hash, vector)])
+        return vector
+
+# Offline stand-in for the OpenAI embeddings
+class LocalEmbeddings(Embeddings):
+    """Deterministic embeddings from hashed word and character n-grams.
+
+    Needs no network or model download, used for tests, benchmarks and offline
+    runs. Texts sharing words end up close to each other.
+    """
+
+    def __init__(self, dim=3072):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = text.lower().split()
+        grams = words + [word[i:i + 3] for word in words for i in range(max(len(word) - 2, 1))]
+        for gram in grams:
+            digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
@@ -0,0 +1,294 @@
+from dotenv import load_dotenv
+import math
+import os
+import faiss
+import numpy as np
+
+load_dotenv()
+
+# Index type of the vector store: flat, sq8, pq, ivf_flat, ivf_pq or hnsw
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+# Number of IVF lists, 0 picks 4 * sqrt(number of vectors)
+FAISS_NLIST = int(os.getenv("FAISS_NLIST", 0))
+# PQ sub-quantizers, must divide the (truncated) embedding dimension
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", 64))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", 32))
+# Search time knobs, more probes / a larger ef is slower but more accurate
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", 16))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", 64))
+
+INDEX_TYPES = ["flat", "sq8", "pq", "ivf_flat", "ivf_pq", "hnsw"]
+# Types that store compressed codes instead of the vectors
+LOSSY_TYPES = ["sq8", "pq", "ivf_pq"]
+
+# Number of IVF lists for a corpus of n vectors
+def nlist_for(n):
+    if FAISS_NLIST:
+        return FAISS_NLIST
+    # faiss wants roughly 39 training points per list
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+# Minimum number of vectors needed to train an index type
+def min_training_vectors(index_type):
+    if index_type == "ivf_flat":
+        return 39
+    if index_type in ("pq", "ivf_pq"):
+        # 8 bit PQ codes need 256 centroids per sub-quantizer
+        return 256
+    if index_type == "sq8":
+        # the 8 bit range of every dimension is learned from the training vectors
+        return 256
+    return 0
+
+# Vectors collected before the flat starter index is converted to index_type
+def conversion_threshold(index_type):
+    """Well above min_training_vectors, quantizers trained on a few hundred
+    vectors stay inaccurate for the life of the index."""
+    threshold = min_training_vectors(index_type)
+    if index_type in ("pq", "ivf_pq"):
+        # faiss asks for 39 training points per centroid, PQ codebooks have 256
+        threshold = max(threshold, 39 * 256)
+    if index_type == "sq8":
+        # the value ranges settle after a few thousand vectors
+        threshold = max(threshold, 2048)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # 39 points for each of FAISS_NLIST or 4 * sqrt(n) lists
+        threshold = max(threshold, 39 * FAISS_NLIST if FAISS_NLIST else (4 * 39) ** 2)
+    return threshold
+
+# Whether an IVF index has outgrown the lists it was trained with
+def needs_retraining(index):
+    """With the default nlist the lists are retrained once the corpus asks for
+    twice as many, so retraining cost stays proportional to the adds."""
+    if FAISS_NLIST or index_type(index) not in ("ivf_flat", "ivf_pq"):
+        return False
+    return nlist_for(index.ntotal) >= 2 * faiss.extract_index_ivf(index).nlist
+
+# faiss.index_factory description of an index type
+def factory_string(index_type, n):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type == "pq":
+        return f"PQ{FAISS_PQ_M}"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist_for(n)},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{nlist_for(n)},PQ{FAISS_PQ_M}"
+    if index_type == "hnsw":
+        return f"HNSW{FAISS_HNSW_M},Flat"
+    raise ValueError(f"Unknown FAISS index type {index_type}. Choose one of {INDEX_TYPES}.")
+
+# Build an empty index of the given type, trained on vectors if it needs training
+def build_index(index_type, dim, vectors=None):
+    """Returns an L2 index ready for index.add.
+
+    IVF indexes are trained on `vectors`, which must hold at least
+    min_training_vectors(index_type) rows.
+    """
+    n = 0 if vectors is None else len(vectors)
+    if n < min_training_vectors(index_type):
+        raise ValueError(f"{index_type} needs at least {min_training_vectors(index_type)} "
+                         f"vectors to train, got {n}")
+    index = faiss.index_factory(dim, factory_string(index_type, n), faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+    set_search_params(index)
+    return index
+
+# Apply the runtime search knobs that the index understands
+def set_search_params(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    kind = index_type(index)
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    elif kind == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = ef_search
+    return index
+
+# Index type of an existing index
+def index_type(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    return type(index).__name__
+
+# All vectors stored in an index, in position order
+def index_vectors(index):
+    """SQ and PQ indexes return their lossy reconstruction."""
+    if index_type(index) not in ("ivf_flat", "ivf_pq"):
+        return index.reconstruct_n(0, index.ntotal)
+    # IVF indexes only reconstruct with a direct map, a temporary one is
+    # dropped again afterwards
+    ivf = faiss.extract_index_ivf(index)
+    if ivf.direct_map.type != faiss.DirectMap.NoMap:
+        return index.reconstruct_n(0, index.ntotal)
+    ivf.make_direct_map()
+    vectors = index.reconstruct_n(0, index.ntotal)
+    ivf.make_direct_map(False)
+    return vectors
+
+# Stored vectors of the given positions
+def reconstruct_positions(index, positions):
+    """IVF indexes keep a direct map (8 bytes per vector) from the first call
+    on, so the cost depends on the number of positions, not on the lists."""
+    if index_type(index) in ("ivf_flat", "ivf_pq"):
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+    return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+# Search an index, leaving out the ids in `excluded`
+def search_excluding(index, queries, k, excluded=()):
+    if not len(excluded):
+        return index.search(queries, k)
+    # the selectors stay referenced until the search returns
+    batch = faiss.IDSelectorBatch(np.asarray(sorted(excluded), dtype=np.int64))
+    selector = faiss.IDSelectorNot(batch)
+    kind = index_type(index)
+    if kind == "hnsw":
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=faiss.downcast_index(index).hnsw.efSearch)
+    elif kind in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+# Rebuild an index as another type, keeping vector positions
+def convert_index(index, new_type):
+    vectors = index_vectors(index)
+    new_index = build_index(new_type, index.d, vectors)
+    new_index.add(vectors)
+    return new_index
+
+# Remove vectors by position, the remaining vectors keep their order
+def remove_positions(index, positions):
+    """Returns the index without the given positions, renumbered to 0..ntotal-1.
+
+    Flat, SQ, PQ and IVF indexes are changed in place. HNSW cannot remove vectors, it
+    is rebuilt from the remaining vectors and the new index is returned, which
+    costs as much as indexing them again.
+    """
+    positions = np.unique(np.asarray(positions, dtype=np.int64))
+    if len(positions) == 0:
+        return index
+    kind = index_type(index)
+    if kind in ("flat", "sq8", "pq"):
+        # flat code indexes shift the later vectors down themselves
+        index.remove_ids(positions)
+        return index
+    if kind in ("ivf_flat", "ivf_pq"):
+        # remove_ids does not work with a direct map, it is rebuilt for the new ids
+        ivf = faiss.extract_index_ivf(index)
+        direct_map = ivf.direct_map.type != faiss.DirectMap.NoMap
+        ivf.make_direct_map(False)
+        index.remove_ids(positions)
+        # IVF lists keep the old ids, shift them down to close the gaps
+        for list_no in range(ivf.nlist):
+            size = ivf.invlists.list_size(list_no)
+            if size:
+                ids = faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), size)
+                ids -= np.searchsorted(positions, ids)
+        if direct_map:
+            ivf.make_direct_map()
+        return index
+    vectors = np.delete(index_vectors(index), positions, axis=0)
+    new_index = build_index(kind, index.d, vectors)
+    new_index.add(vectors)
+    return new_index
+
+# Keep the first dim values of each vector, rescaled to unit length
+def truncate_vectors(vectors, dim):
+    """text-embedding-3 vectors are trained so that a prefix of an embedding
+    is itself a usable embedding once it is normalized again."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dim or dim >= vectors.shape[-1]:
+        return vectors
+    prefix = vectors[..., :dim]
+    norms = np.linalg.norm(prefix, axis=-1, keepdims=True)
+    return np.ascontiguousarray(prefix / np.where(norms == 0, 1, norms))
+
+# Exact L2 re-ranking of candidate positions
+def rerank(query_vector, positions, vectors, k):
+    """Returns the k closest (positions, distances), `vectors` are the rows of `positions`."""
+    distances = ((np.asarray(vectors, dtype=np.float32) - query_vector) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return np.asarray(positions)[order], distances[order]
+
+# Full precision vectors on disk, row i belongs to index position i
+class VectorFile:
+    """float32 rows in a raw file, read through a memory map.
+
+    Only the rows a query re-ranks are read, the OS page cache decides how
+    much of the file stays in memory. Rows are appended in the order they are
+    added to the index and removed with the same positions.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self._map = None
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // (4 * self.dim)
+        except FileNotFoundError:
+            return 0
+
+    def _rows(self):
+        if self._map is None or len(self._map) != len(self):
+            self._map = np.memmap(self.path, dtype=np.float32, mode="r", shape=(len(self), self.dim)) \
+                if len(self) else np.empty((0, self.dim), dtype=np.float32)
+        return self._map
+
+    def get(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        order = np.argsort(positions)
+        rows = np.empty((len(positions), self.dim), dtype=np.float32)
+        # reading in file order touches every page once
+        rows[order] = self._rows()[positions[order]]
+        return rows
+
+    def append(self, vectors):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+
+    # Drop rows past n, e.g. vectors whose index add was never saved
+    def truncate(self, n):
+        if len(self) > n:
+            self._map = None
+            with open(self.path, "r+b") as f:
+                f.truncate(n * 4 * self.dim)
+
+    # Write the file again without the given rows, block by block
+    def remove(self, positions, block_size=65536):
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        rows = self._rows()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(rows), block_size):
+                block = np.asarray(rows[start:start + block_size])
+                removed = positions[(positions >= start) & (positions < start + len(block))] - start
+                f.write(np.delete(block, removed, axis=0).tobytes())
+        self._map = None
+        del rows
+        os.replace(tmp_path, self.path)
+
+    def reset(self, vectors):
+        tmp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._map = None
+        os.replace(tmp_path, self.path)
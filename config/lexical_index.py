@@ -0,0 +1,317 @@
+from dotenv import load_dotenv
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+import numpy as np
+
+load_dotenv()
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Segments kept before the smallest ones are merged
+LEXICAL_MAX_SEGMENTS = int(os.getenv("LEXICAL_MAX_SEGMENTS", 8))
+
+# Share of the documents above which a term is left out of queries that have rarer terms
+COMMON_TERM_SHARE = 0.5
+# Segments with fewer live documents than this share are rewritten without the deleted ones
+COMPACT_LIVE_SHARE = 0.5
+
+# Longer terms are cut, the query terms the same way
+MAX_TERM_BYTES = 64
+# chunk ids are 32 characters, 36 fits the uuid ids of stores saved before them
+CHUNK_ID_BYTES = 36
+
+# Words, numbers and codes like AB-1234 or 3.5.1 as one term
+_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+_PARTS = re.compile(r"\w+")
+
+SEGMENT_FILES = ["terms", "offsets", "docs", "tfs", "doc_len", "doc_ids"]
+
+# Lower-cased terms of a text, codes are indexed whole and by their parts
+def tokenize(text):
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        terms.append(token.encode("utf-8")[:MAX_TERM_BYTES])
+        parts = _PARTS.findall(token)
+        if len(parts) > 1:
+            terms.extend(part.encode("utf-8")[:MAX_TERM_BYTES] for part in parts)
+    return terms
+
+def _save(path, array):
+    # written next to the target and swapped in, readers never see half a file
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, f"{path}.npy")
+
+# One immutable part of the index, its postings are memory-mapped
+class Segment:
+    """Postings of a segment are stored term by term.
+
+    `terms` is the sorted vocabulary, the postings of terms[i] are
+    docs[offsets[i]:offsets[i + 1]] with their term frequencies in `tfs`.
+    Documents are numbered within the segment, `doc_ids` holds their chunk
+    ids and `live` marks the ones that were not deleted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for name in SEGMENT_FILES:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.live = np.load(os.path.join(path, "live.npy"))
+
+    def postings(self, term):
+        # a wider term is not in the vocabulary, and numpy would copy the array to compare it
+        if len(term) > self.terms.itemsize:
+            return None
+        i = np.searchsorted(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    @staticmethod
+    def write(path, posting_terms, posting_docs, posting_tfs, doc_len, doc_ids):
+        """Writes a segment from one (term, doc, tf) row per posting."""
+        os.makedirs(path, exist_ok=True)
+        terms, term_numbers = np.unique(np.asarray(posting_terms, dtype=f"S{MAX_TERM_BYTES}"),
+                                        return_inverse=True)
+        posting_docs = np.asarray(posting_docs, dtype=np.int32)
+        order = np.lexsort((posting_docs, term_numbers))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_numbers, minlength=len(terms)), out=offsets[1:])
+        # the narrowest byte width that fits the longest term
+        width = max(1, max((len(term) for term in terms), default=1))
+        arrays = {
+            "terms": terms.astype(f"S{width}"),
+            "offsets": offsets,
+            "docs": posting_docs[order],
+            "tfs": np.minimum(np.asarray(posting_tfs)[order], np.iinfo(np.uint16).max).astype(np.uint16),
+            "doc_len": np.asarray(doc_len, dtype=np.int32),
+            "doc_ids": np.asarray(doc_ids, dtype=f"S{CHUNK_ID_BYTES}"),
+        }
+        for name, array in arrays.items():
+            _save(os.path.join(path, name), array)
+        _save(os.path.join(path, "live"), np.ones(len(doc_len), dtype=bool))
+
+    # (term, doc, tf) rows of the live postings, docs renumbered from doc_base
+    def live_postings(self, doc_base):
+        terms = np.repeat(np.asarray(self.terms), np.diff(self.offsets))
+        docs = np.asarray(self.docs)
+        keep = self.live[docs]
+        new_numbers = np.cumsum(self.live) - 1 + doc_base
+        return terms[keep], new_numbers[docs[keep]], np.asarray(self.tfs)[keep]
+
+def _live_count(entry, segment, docs):
+    if entry["live"] == entry["docs"]:
+        return len(docs)
+    return int(np.count_nonzero(segment.live[docs]))
+
+# BM25 index over the chunks of the vector store
+class LexicalIndex:
+    """On-disk inverted index made of immutable segments.
+
+    Every add writes a new segment, deletes only mark documents in the
+    segment's `live` array. Once there are more than LEXICAL_MAX_SEGMENTS
+    segments the ones with the fewest live documents are merged, which also
+    drops deleted documents, and a segment that is mostly deleted is
+    rewritten right away. Postings are memory-mapped, so memory use does not grow with
+    the number of chunks and a query reads only the postings of its terms.
+    Adds and deletes must not run concurrently, searches can run any time.
+    """
+
+    def __init__(self, path, max_segments=LEXICAL_MAX_SEGMENTS):
+        self.path = path
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._manifest_path = os.path.join(path, "manifest.json")
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {"next_segment": 0, "segments": []}
+        self.segments = [Segment(os.path.join(path, entry["name"])) for entry in self.manifest["segments"]]
+        # merged segments that could not be removed while they were open, or an add that did not finish
+        names = {entry["name"] for entry in self.manifest["segments"]}
+        for name in os.listdir(path):
+            if name.startswith("segment_") and name not in names:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    def __len__(self):
+        return sum(entry["live"] for entry in self.manifest["segments"])
+
+    def _save_manifest(self):
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _new_segment_name(self):
+        name = f"segment_{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        return name
+
+    # Add chunks as a new segment
+    def add(self, doc_ids, texts):
+        posting_terms, posting_docs, posting_tfs, doc_len = [], [], [], []
+        for doc, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_len.append(len(terms))
+            for term, tf in Counter(terms).items():
+                posting_terms.append(term)
+                posting_docs.append(doc)
+                posting_tfs.append(tf)
+        if not doc_len:
+            return
+        name = self._new_segment_name()
+        Segment.write(os.path.join(self.path, name), posting_terms, posting_docs, posting_tfs, doc_len, doc_ids)
+        with self._lock:
+            self.manifest["segments"].append({"name": name, "docs": len(doc_len), "live": len(doc_len),
+                                              "length": int(sum(doc_len))})
+            self.segments = self.segments + [Segment(os.path.join(self.path, name))]
+        self._merge_segments()
+        self._save_manifest()
+
+    # Mark chunks as deleted, they are dropped at the next merge
+    def delete(self, doc_ids):
+        doc_ids = np.asarray(list(doc_ids), dtype=f"S{CHUNK_ID_BYTES}")
+        if len(doc_ids) == 0:
+            return
+        for entry, segment in zip(self.manifest["segments"], self.segments):
+            deleted = np.isin(segment.doc_ids, doc_ids) & segment.live
+            if not deleted.any():
+                continue
+            live = segment.live & ~deleted
+            _save(os.path.join(segment.path, "live"), live)
+            segment.live = live
+            entry["live"] -= int(deleted.sum())
+            entry["length"] -= int(segment.doc_len[deleted].sum())
+        # every query would still scan the postings of the deleted documents
+        sparse = [i for i, entry in enumerate(self.manifest["segments"])
+                  if entry["live"] < entry["docs"] * COMPACT_LIVE_SHARE]
+        if sparse:
+            self._rewrite(sparse)
+        self._save_manifest()
+
+    # Merge the segments with the fewest live documents until at most max_segments are left
+    def _merge_segments(self):
+        if len(self.segments) <= self.max_segments:
+            return
+        by_size = sorted(range(len(self.segments)), key=lambda i: self.manifest["segments"][i]["live"])
+        self._rewrite(sorted(by_size[:len(self.segments) - self.max_segments + 1]))
+
+    # Replace the given segments with one holding their live documents
+    def _rewrite(self, merge):
+        parts, doc_len, doc_ids = [], [], []
+        for i in merge:
+            segment = self.segments[i]
+            parts.append(segment.live_postings(len(doc_len)))
+            doc_len.extend(np.asarray(segment.doc_len)[segment.live].tolist())
+            doc_ids.extend(np.asarray(segment.doc_ids)[segment.live].tolist())
+        new_entries, new_segments = [], []
+        if doc_len:
+            name = self._new_segment_name()
+            Segment.write(os.path.join(self.path, name),
+                          np.concatenate([part[0].astype(f"S{MAX_TERM_BYTES}") for part in parts]),
+                          np.concatenate([part[1] for part in parts]),
+                          np.concatenate([part[2] for part in parts]), doc_len, doc_ids)
+            new_entries = [{"name": name, "docs": len(doc_len), "live": len(doc_len), "length": int(sum(doc_len))}]
+            new_segments = [Segment(os.path.join(self.path, name))]
+
+        removed = [self.manifest["segments"][i]["name"] for i in merge]
+        with self._lock:
+            keep = [i for i in range(len(self.segments)) if i not in set(merge)]
+            self.manifest["segments"] = [self.manifest["segments"][i] for i in keep] + new_entries
+            self.segments = [self.segments[i] for i in keep] + new_segments
+        self._save_manifest()
+        for old in removed:
+            # open memory maps keep the data readable for searches still running
+            shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    # BM25 search
+    def search(self, query, k=5, doc_ids=None):
+        """Returns up to k (chunk id, score) pairs, best first.
+
+        With `doc_ids` only those chunks are ranked. No embedding is computed,
+        the cost depends on the postings of the query terms. Terms found in
+        more than COMMON_TERM_SHARE of the documents are skipped when the query
+        has rarer terms.
+        """
+        with self._lock:
+            entries = list(self.manifest["segments"])
+            segments = list(self.segments)
+        total_docs = sum(entry["live"] for entry in entries)
+        if total_docs == 0:
+            return []
+        avg_len = sum(entry["length"] for entry in entries) / total_docs
+        allowed = None if doc_ids is None else np.asarray(list(doc_ids), dtype=f"S{CHUNK_ID_BYTES}")
+
+        terms = list(dict.fromkeys(tokenize(query)))
+        found = [[segment.postings(term) for term in terms] for segment in segments]
+        # document frequencies of the live documents, like total_docs
+        df = [sum(_live_count(entry, segment, postings[t][0])
+                  for entry, segment, postings in zip(entries, segments, found) if postings[t] is not None)
+              for t in range(len(terms))]
+        # terms in most documents barely change the ranking but cost the most, skip them next to rarer terms
+        common = [df[t] > total_docs * COMMON_TERM_SHARE for t in range(len(terms))]
+        if not all(common):
+            found = [[None if common[t] else hit for t, hit in enumerate(postings)] for postings in found]
+
+        scores, ids = [], []
+        for segment, postings in zip(segments, found):
+            docs, weights = [], []
+            for t, hit in enumerate(postings):
+                if hit is None:
+                    continue
+                idf = math.log(1 + (total_docs - df[t] + 0.5) / (df[t] + 0.5))
+                tfs = hit[1].astype(np.float32)
+                lengths = segment.doc_len[hit[0]]
+                docs.append(hit[0])
+                weights.append(idf * tfs * (BM25_K1 + 1)
+                               / (tfs + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_len)))
+            if not docs:
+                continue
+            docs, weights = np.concatenate(docs), np.concatenate(weights)
+            if len(docs) * 8 > len(segment.live):
+                # common terms, summing into one slot per document is cheaper than sorting the postings
+                segment_scores = np.bincount(docs, weights=weights, minlength=len(segment.live))
+                segment_scores[~segment.live] = 0
+                docs = np.flatnonzero(segment_scores)
+                segment_scores = segment_scores[docs]
+            else:
+                docs, inverse = np.unique(docs, return_inverse=True)
+                segment_scores = np.bincount(inverse, weights=weights)
+                keep = segment.live[docs]
+                docs, segment_scores = docs[keep], segment_scores[keep]
+            if allowed is not None:
+                keep = np.isin(segment.doc_ids[docs], allowed)
+                docs, segment_scores = docs[keep], segment_scores[keep]
+            # only the k best of each segment can make the overall top k
+            if len(docs) > k:
+                top = np.argpartition(-segment_scores, k - 1)[:k]
+                docs, segment_scores = docs[top], segment_scores[top]
+            scores.append(segment_scores)
+            ids.append(segment.doc_ids[docs])
+
+        if not scores:
+            return []
+        scores = np.concatenate(scores)
+        ids = np.concatenate(ids)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[i].decode("ascii"), float(scores[i])) for i in top]
+
+    # Remove every segment
+    def clear(self):
+        with self._lock:
+            for entry in self.manifest["segments"]:
+                shutil.rmtree(os.path.join(self.path, entry["name"]), ignore_errors=True)
+            self.manifest = {"next_segment": self.manifest["next_segment"], "segments": []}
+            self.segments = []
+        self._save_manifest()
@@ -0,0 +1,266 @@
+from dotenv import load_dotenv
+import contextvars
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is left out there
+    resource = None
+
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Folder the per run JSON and the Prometheus text file are written to
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+
+_local = threading.local()
+_gauges = {}
+
+# Peak resident set size of the process in bytes
+def peak_rss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+# Timings and counts of the instrumented stages
+class Run:
+    """Metrics collected while the run is current in the calling context.
+
+    Threads started with the context copied, like the pipeline workers,
+    report into the run of the thread that started them. `job` keeps the
+    files of concurrent sessions apart.
+
+    Wall and CPU seconds of a stage exclude the time spent in instrumented
+    stages it calls, so the stages add up to the total. CPU time is the time
+    of the calling thread, work done in worker processes or subprocesses
+    (OCR, table extraction) shows up as wall time only.
+    """
+
+    def __init__(self, name, job=None):
+        self.name = name
+        self.job = job
+        self.started = time.time()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                  "peak_rss_bytes": None, "bytes_written": 0, "items": {}}
+        return self.stages[stage]
+
+    def record(self, stage, wall, cpu, rss=None, calls=1):
+        with self._lock:
+            entry = self._stage(stage)
+            entry["calls"] += calls
+            entry["wall_seconds"] += wall
+            entry["cpu_seconds"] += cpu
+            if rss is not None:
+                entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"] or 0, rss)
+
+    def count(self, stage, bytes_written=0, **items):
+        with self._lock:
+            entry = self._stage(stage)
+            entry["bytes_written"] += bytes_written
+            for item, n in items.items():
+                entry["items"][item] = entry["items"].get(item, 0) + n
+
+    def to_dict(self):
+        with self._lock:
+            stages = {stage: dict(entry, items=dict(entry["items"]),
+                                  wall_seconds=round(entry["wall_seconds"], 4),
+                                  cpu_seconds=round(entry["cpu_seconds"], 4))
+                      for stage, entry in self.stages.items()}
+        return {
+            "run": self.name,
+            "job": self.job,
+            "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            "duration_seconds": round(time.time() - self.started, 4),
+            "peak_rss_bytes": peak_rss(),
+            "stages": stages,
+            "gauges": {name: gauge() for name, gauge in _gauges.items()},
+        }
+
+# Run of the current context, sessions and batch runs each have their own
+_current = contextvars.ContextVar("metrics_run", default=None)
+_default_run = Run("default")
+
+# Start collecting into a new run in the current context
+def start_run(name, job=None):
+    return use_run(Run(name, job))
+
+# Make an existing run current again, e.g. on every Streamlit rerun of a session
+def use_run(run):
+    _current.set(run)
+    return run
+
+def current_run():
+    return _current.get() or _default_run
+
+# Call fn in a copy of the current context, for threads that report into the caller's run
+def in_context(fn):
+    return functools.partial(contextvars.copy_context().run, fn)
+
+# Report a value sampled when the metrics are exported, e.g. the DB pool stats
+def register_gauge(name, fn):
+    _gauges[name] = fn
+
+class _Frame:
+    __slots__ = ("stage", "run", "wall", "cpu", "child_wall", "child_cpu")
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.run = current_run()
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+
+def _push(stage):
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    frame = _Frame(stage)
+    stack.append(frame)
+    return frame
+
+def _pop(frame, calls=1):
+    wall = time.perf_counter() - frame.wall
+    cpu = time.thread_time() - frame.cpu
+    stack = _local.stack
+    stack.pop()
+    if stack:
+        stack[-1].child_wall += wall
+        stack[-1].child_cpu += cpu
+    frame.run.record(frame.stage, wall - frame.child_wall, cpu - frame.child_cpu, rss=peak_rss(), calls=calls)
+
+# Add item counts and bytes written to the innermost stage running in this thread
+def count(bytes_written=0, **items):
+    stack = getattr(_local, "stack", None)
+    if METRICS_ENABLED and stack:
+        stack[-1].run.count(stack[-1].stage, bytes_written=bytes_written, **items)
+
+# Time a block of code as a stage
+class timed:
+    def __init__(self, stage):
+        self.stage = stage
+        self.frame = None
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            self.frame = _push(self.stage)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.frame is not None:
+            _pop(self.frame)
+        return False
+
+# Decorator that times every call of a function as a stage
+def instrument(stage, item="items"):
+    """Generator functions are timed while they produce items, not while the
+    consumer holds them, and every yielded item is counted as `item`."""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                if not METRICS_ENABLED:
+                    yield from fn(*args, **kwargs)
+                    return
+                generator = fn(*args, **kwargs)
+                calls = 1
+                try:
+                    while True:
+                        frame = _push(stage)
+                        try:
+                            value = next(generator)
+                        except StopIteration:
+                            return
+                        else:
+                            count(**{item: 1})
+                        finally:
+                            _pop(frame, calls=calls)
+                        calls = 0
+                        yield value
+                finally:
+                    generator.close()
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Prometheus text exposition format of a run
+def to_prometheus(run=None):
+    """Every sample is labelled with the run and its job, the textfile
+    collector rejects series that repeat across the .prom files of jobs."""
+    data = (run or current_run()).to_dict()
+    run_labels = {"job": data["job"], "run": data["run"]} if data["job"] else {"run": data["run"]}
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_label_value(label)}"' for key, label in {**run_labels, **labels}.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+
+    stages = data["stages"]
+    metric("etl_stage_calls_total", "counter", "Calls of the pipeline stage.",
+           [({"stage": stage}, entry["calls"]) for stage, entry in stages.items()])
+    metric("etl_stage_wall_seconds_total", "counter", "Wall time of the stage, excluding nested stages.",
+           [({"stage": stage}, entry["wall_seconds"]) for stage, entry in stages.items()])
+    metric("etl_stage_cpu_seconds_total", "counter", "CPU time of the calling thread in the stage.",
+           [({"stage": stage}, entry["cpu_seconds"]) for stage, entry in stages.items()])
+    metric("etl_stage_items_total", "counter", "Items handled by the stage.",
+           [({"stage": stage, "item": item}, n) for stage, entry in stages.items()
+            for item, n in entry["items"].items()])
+    metric("etl_stage_bytes_written_total", "counter", "Bytes written by the stage.",
+           [({"stage": stage}, entry["bytes_written"]) for stage, entry in stages.items()])
+    metric("etl_stage_peak_rss_bytes", "gauge", "Peak resident set size of the process after the stage.",
+           [({"stage": stage}, entry["peak_rss_bytes"]) for stage, entry in stages.items()
+            if entry["peak_rss_bytes"] is not None])
+    if data["peak_rss_bytes"] is not None:
+        metric("etl_peak_rss_bytes", "gauge", "Peak resident set size of the process.",
+               [({}, data["peak_rss_bytes"])])
+    for gauge, values in data["gauges"].items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                metric(f"etl_{gauge}_{key}", "gauge", f"{gauge} {key}.", [({}, value)])
+    return "\n".join(lines) + "\n"
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _file_name(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+# Write the run as METRICS_DIR/<job>_<run>.json and METRICS_DIR/etl_<job>.prom
+def save(run=None, folder=METRICS_DIR):
+    """The .prom file can be picked up by the node_exporter textfile collector.
+    Runs without a job write <run>.json and etl.prom."""
+    run = run or current_run()
+    prefix = f"{_file_name(run.job)}_" if run.job else ""
+    _write(os.path.join(folder, f"{prefix}{_file_name(run.name)}.json"), json.dumps(run.to_dict(), indent=2))
+    prom_name = f"etl_{_file_name(run.job)}.prom" if run.job else "etl.prom"
+    _write(os.path.join(folder, prom_name), to_prometheus(run))
@@ -0,0 +1,68 @@
+import threading
+import time
+
+# Lazily loaded models, shared by the whole process
+_factories = {}
+_instances = {}
+_load_times = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+# Register how to load a model, the factory runs on first get()
+def register(name, factory):
+    with _registry_lock:
+        _factories[name] = factory
+        _locks.setdefault(name, threading.Lock())
+        _instances.pop(name, None)
+
+# Replace a model with a ready instance, e.g. a stub in benchmarks
+def set_instance(name, instance):
+    with _registry_lock:
+        _locks.setdefault(name, threading.Lock())
+        _instances[name] = instance
+
+# Get a model, loading it on first use
+def get(name):
+    if name in _instances:
+        return _instances[name]
+    if name not in _locks:
+        raise KeyError(f"No model registered as {name}")
+    with _locks[name]:
+        # another thread may have loaded it while we waited
+        if name not in _instances:
+            start = time.perf_counter()
+            _instances[name] = _factories[name]()
+            _load_times[name] = time.perf_counter() - start
+    return _instances[name]
+
+def is_loaded(name):
+    return name in _instances
+
+# Seconds each model took to load
+def load_times():
+    return dict(_load_times)
+
+# Load models ahead of their first use
+def warm_up(names=None, background=True):
+    """Loads the given (default: all registered) models.
+
+    With background=True the loading runs in a daemon thread that is returned,
+    failures are left for the first real get() to raise.
+    """
+    names = list(_factories) if names is None else names
+
+    def load_all():
+        for name in names:
+            try:
+                get(name)
+            except Exception as e:
+                if not background:
+                    raise
+                print(f"Warm up of {name} failed: {e}")
+
+    if not background:
+        load_all()
+        return None
+    thread = threading.Thread(target=load_all, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
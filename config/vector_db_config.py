@@ -1,32 +1,160 @@
 from dotenv import load_dotenv
 load_dotenv()
+import hashlib
+import json
 import os
-from uuid import uuid4
+import threading
 
-import faiss
-from langchain_openai import OpenAIEmbeddings
+import numpy as np
 from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 from langchain_text_splitters.character import CharacterTextSplitter
+import config.model_registry as models
+import config.metrics as metrics
+from config.embedding_cache import CachedEmbeddings, LocalEmbeddings
+from config.faiss_index import (FAISS_INDEX_TYPE, INDEX_TYPES, LOSSY_TYPES, VectorFile, build_index,
+                                conversion_threshold, index_type, index_vectors, needs_retraining,
+                                reconstruct_positions, remove_positions, rerank, search_excluding,
+                                set_search_params, truncate_vectors)
+from config.lexical_index import LexicalIndex
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
+# Embedding model, "local" swaps OpenAI for an offline stand-in
+EMBEDDINGS_PROVIDER = os.getenv("EMBEDDINGS_PROVIDER", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
 
-# Initialize the vector store
-# check if the vector store exists
-if os.path.exists("faiss_vector_store"):
-    vector_store = FAISS.load_local(
-        "faiss_vector_store", 
-        embeddings, 
-        allow_dangerous_deserialization=True
-    )
-else:
-    vector_store = FAISS(
-        embedding_function=embeddings, 
-        index=faiss.IndexFlatL2(len(embeddings.embed_query("hello world"))),
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
-    )
+# Output size of the known models, so a new index needs no API call
+EMBEDDING_DIMS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 0)) or EMBEDDING_DIMS.get(EMBEDDING_MODEL, 0)
+
+# Create the embedding function on first use
+def load_embeddings():
+    if EMBEDDINGS_PROVIDER == "local":
+        base_embeddings = LocalEmbeddings(dim=EMBEDDING_DIM or 3072)
+    else:
+        from langchain_openai import OpenAIEmbeddings
+        base_embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    return CachedEmbeddings(base_embeddings, model_name=f"{EMBEDDINGS_PROVIDER}:{EMBEDDING_MODEL}")
+
+# Index only the first values of each embedding, e.g. 256 or 1024, 0 keeps all of them
+EMBEDDING_TRUNCATE_DIM = int(os.getenv("EMBEDDING_TRUNCATE_DIM", 0))
+# Candidates per result re-ranked with the full precision vectors of a compressed index, 0 turns
+# re-ranking off, the vectors are still kept
+FAISS_RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", 4))
+FULL_VECTORS_PATH = os.path.join("faiss_vector_store", "full_vectors.f32")
+
+# Share of deleted vectors an HNSW index keeps before its graph is rebuilt without them
+FAISS_HNSW_MAX_DELETED = float(os.getenv("FAISS_HNSW_MAX_DELETED", 0.2))
+
+# Chunks embedded and added at a time when a document is streamed in
+ADD_BATCH_SIZE = int(os.getenv("VECTOR_ADD_BATCH_SIZE", 64))
+
+# BM25 index of the chunks, kept inside the vector store folder
+LEXICAL_INDEX_DIR = os.path.join("faiss_vector_store", "lexical")
+# Rank constant of reciprocal rank fusion, larger values flatten the rank weights
+RRF_K = int(os.getenv("RRF_K", 60))
+SEARCH_MODES = ["vector", "lexical", "hybrid"]
+
+# filename -> FAISS positions of its chunks, kept next to index_to_docstore_id
+file_index = {}
+lexical_index = None
+# full precision vectors of a compressed index, None when they are not kept
+full_vectors = None
+# positions deleted from an HNSW index but still in its graph, mapped to None in index_to_docstore_id
+deleted_positions = set()
+_write_lock = threading.Lock()
+
+def rebuild_file_index(vector_store=None):
+    vector_store = vector_store or get_vector_store()
+    file_index.clear()
+    deleted_positions.clear()
+    for position, doc_id in vector_store.index_to_docstore_id.items():
+        if doc_id is None:
+            deleted_positions.add(position)
+            continue
+        doc = vector_store.docstore.search(doc_id)
+        file_index.setdefault(doc.metadata.get("filename"), []).append(position)
+
+# Initialize the vector store on first use
+def load_vector_store():
+    embeddings = models.get("embeddings")
+    # check if the vector store exists
+    if os.path.exists(os.path.join("faiss_vector_store", "index.faiss")):
+        vector_store = FAISS.load_local(
+            "faiss_vector_store", 
+            embeddings, 
+            allow_dangerous_deserialization=True
+        )
+        set_search_params(vector_store.index)
+    else:
+        # types that need training start flat and are converted once there is enough data
+        initial_type = FAISS_INDEX_TYPE if conversion_threshold(FAISS_INDEX_TYPE) == 0 else "flat"
+        dim = embedding_dim()
+        if 0 < EMBEDDING_TRUNCATE_DIM < dim:
+            dim = EMBEDDING_TRUNCATE_DIM
+        vector_store = FAISS(
+            embedding_function=embeddings, 
+            index=build_index(initial_type, dim),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+    rebuild_file_index(vector_store)
+    load_lexical_index(vector_store)
+    load_full_vectors(vector_store)
+    return vector_store
+
+def embedding_dim():
+    return EMBEDDING_DIM or len(models.get("embeddings").embed_query("hello world"))
+
+# Whether the full precision vectors are kept next to the index
+def keeps_full_vectors(index, new_type=FAISS_INDEX_TYPE):
+    """Only compressed indexes need them, truncated ones or those storing
+    SQ / PQ codes. A flat index that will be converted counts as compressed.
+    They are the only full precision copy, so they are kept whether or not
+    FAISS_RERANK_FACTOR re-ranks with them."""
+    return index.d < embedding_dim() or new_type in LOSSY_TYPES or index_type(index) in LOSSY_TYPES
+
+# Open the full precision vectors of the store
+def load_full_vectors(vector_store):
+    global full_vectors
+    full_vectors = None
+    index = vector_store.index
+    if not keeps_full_vectors(index):
+        return None
+    vectors = VectorFile(FULL_VECTORS_PATH, embedding_dim())
+    # rows past the index come from adds that were never saved
+    vectors.truncate(index.ntotal)
+    if len(vectors) != index.ntotal:
+        print("Searching without re-ranking, the full precision vectors of faiss_vector_store are missing. "
+              "Migrating a store whose index holds the full vectors writes them.")
+        return None
+    full_vectors = vectors
+    return vectors
+
+# Embeddings as stored in the index, truncated to the index's dimension
+def to_index_vectors(vectors):
+    return truncate_vectors(vectors, get_vector_store().index.d)
+
+# Open the BM25 index of the store, building it from the docstore when it is missing or stale
+def load_lexical_index(vector_store):
+    global lexical_index
+    index = LexicalIndex(LEXICAL_INDEX_DIR)
+    doc_ids = [doc_id for doc_id in vector_store.index_to_docstore_id.values() if doc_id is not None]
+    if len(index) != len(doc_ids):
+        index.clear()
+        index.add(doc_ids, [vector_store.docstore.search(doc_id).page_content for doc_id in doc_ids])
+    lexical_index = index
+    return index
+
+models.register("embeddings", load_embeddings)
+models.register("vector_store", load_vector_store)
+
+def get_vector_store():
+    return models.get("vector_store")
 
 # Split the text into smaller chunks
 def split_text(text, chunk_size=1000):
@@ -38,42 +166,390 @@ def split_text(text, chunk_size=1000):
     chunks = char_splitter.split_text(text)
     return chunks
 
-# Insert data to the vector store
+# Key of a document file in the vector store, used as its filename
+def document_key(path):
+    """The content hash keeps files that share a name apart, e.g. uploads of
+    two sessions, while saving the same file again updates its chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"{os.path.basename(path)}#{digest.hexdigest()[:12]}"
+
+# Chunk id from the file name, chunk order, content and metadata, the same chunk always gets the same id
+def chunk_id(filename, order, text, metadata=None):
+    content = text if not metadata else text + json.dumps(metadata, sort_keys=True, default=str)
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{filename}\0{order}\0{content_hash}".encode("utf-8")).hexdigest()[:32]
+
+# Insert or update the data of a file in the vector store
 def add_data_to_vector_store(filename, data):
-    # create document chunks
-    chunks = split_text(data)
-
-    # create id for the document
-    documents = []
-    for i, chunk in enumerate(chunks):
-        doc = Document(
-            page_content=chunk,
-            metadata={
-                "filename": filename,
-                "chunk_order": i,
-            }
-        )
-        documents.append(doc)
-    
-    doc_ids = [str(uuid4()) for _ in range(len(chunks))]
-    vector_store.add_documents(documents=documents, ids=doc_ids)
-    vector_store.save_local("faiss_vector_store")
+    """Upserts the text `data` as the content of `filename`, split by split_text.
+    Returns the number of (added, removed) chunks."""
+    return add_chunks_to_vector_store(filename, ((chunk, {}) for chunk in split_text(data)))
+
+# Insert or update the chunks of a file in the vector store
+@metrics.instrument("add_data_to_vector_store")
+def add_chunks_to_vector_store(filename, chunks, batch_size=ADD_BATCH_SIZE):
+    """Upserts (text, metadata) pairs or scripts.chunking Chunks as the content of `filename`.
+
+    The chunks are consumed as they come and embedded batch_size at a time.
+    Chunks already stored for the file are kept, only new or changed chunks
+    are embedded and added and chunks that are no longer part of the file are
+    removed. Saving the same chunks twice changes nothing.
+    Returns the number of (added, removed) chunks.
+    """
+    vector_store = get_vector_store()
+
+    # sessions share the store, only one of them writes at a time
+    with _write_lock:
+        stored = {vector_store.index_to_docstore_id[position]: position
+                  for position in file_index.get(filename, [])}
+        current_ids = set()
+        batch = []
+        # (id, text) of the added chunks, written to the lexical index as one segment
+        new_chunks = []
+
+        def add_batch():
+            first_position = vector_store.index.ntotal
+            texts = [doc.page_content for _, doc in batch]
+            vectors = np.asarray(models.get("embeddings").embed_documents(texts), dtype=np.float32)
+            vector_store.add_embeddings(zip(texts, to_index_vectors(vectors)),
+                                        metadatas=[doc.metadata for _, doc in batch],
+                                        ids=[doc_id for doc_id, _ in batch])
+            if full_vectors is not None:
+                full_vectors.append(vectors)
+            file_index.setdefault(filename, []).extend(range(first_position, vector_store.index.ntotal))
+            new_chunks.extend((doc_id, doc.page_content) for doc_id, doc in batch)
+
+        start_total = vector_store.index.ntotal
+        try:
+            for order, chunk in enumerate(chunks):
+                text, metadata = (chunk.text, chunk.metadata) if hasattr(chunk, "metadata") else chunk
+                doc_id = chunk_id(filename, order, text, metadata)
+                current_ids.add(doc_id)
+                if doc_id in stored:
+                    continue
+                batch.append((doc_id, Document(page_content=text,
+                                               metadata={"filename": filename, "chunk_order": order, **metadata})))
+                if len(batch) >= batch_size:
+                    add_batch()
+                    batch = []
+            if batch:
+                add_batch()
+            # BM25 only gets chunks whose vectors are in the index
+            if new_chunks:
+                lexical_index.add(*zip(*new_chunks))
+        except BaseException:
+            # an embedding or lexical index failure leaves the store as it was
+            _discard_positions(vector_store, range(start_total, vector_store.index.ntotal))
+            raise
+        added = len(new_chunks)
+        stale_positions = [position for doc_id, position in stored.items() if doc_id not in current_ids]
+
+        if stale_positions:
+            _remove_positions(vector_store, stale_positions)
+        if added:
+            upgrade_index()
+        bytes_written = 0
+        if stale_positions or added:
+            vector_store.save_local("faiss_vector_store")
+            bytes_written = sum(entry.stat().st_size for entry in os.scandir("faiss_vector_store")
+                                if entry.is_file())
+    metrics.count(chunks=len(current_ids), added=added, removed=len(stale_positions),
+                  bytes_written=bytes_written)
+    return added, len(stale_positions)
+
+# Remove all chunks of a file from the vector store
+def delete_document(filename):
+    """Returns the number of removed chunks."""
+    vector_store = get_vector_store()
+    with _write_lock:
+        positions = file_index.get(filename, [])
+        if not positions:
+            return 0
+        count = len(positions)
+        _remove_positions(vector_store, positions)
+        vector_store.save_local("faiss_vector_store")
+    return count
+
+# Remove vectors, their documents and their file_index entries
+def _remove_positions(vector_store, positions):
+    """Other indexes close the position gaps right away. HNSW would rebuild
+    its whole graph for that, so its positions are only marked as deleted and
+    left out of searches, until more than FAISS_HNSW_MAX_DELETED of the index
+    is deleted and compact_index rebuilds it once for all of them."""
+    removed = np.unique(np.asarray(positions, dtype=np.int64))
+    doc_ids = [vector_store.index_to_docstore_id[position] for position in removed.tolist()]
+    vector_store.docstore.delete(doc_ids)
+    lexical_index.delete(doc_ids)
+    if index_type(vector_store.index) != "hnsw":
+        _close_gaps(vector_store, removed)
+        return
+
+    for position in removed.tolist():
+        vector_store.index_to_docstore_id[position] = None
+    deleted_positions.update(removed.tolist())
+    for filename in list(file_index):
+        kept = np.setdiff1d(np.asarray(file_index[filename], dtype=np.int64), removed)
+        if len(kept):
+            file_index[filename] = kept.tolist()
+        else:
+            del file_index[filename]
+    if len(deleted_positions) > FAISS_HNSW_MAX_DELETED * vector_store.index.ntotal:
+        compact_index(vector_store)
+
+# Take back vectors added by a failed add, from the index, the docstore and the lexical index
+def _discard_positions(vector_store, positions):
+    removed = np.asarray(positions, dtype=np.int64)
+    if len(removed) == 0:
+        return
+    # a failure inside add_embeddings can leave vectors without a docstore entry
+    doc_ids = [doc_id for doc_id in map(vector_store.index_to_docstore_id.get, removed.tolist())
+               if doc_id is not None]
+    if doc_ids:
+        vector_store.docstore.delete(doc_ids)
+        lexical_index.delete(doc_ids)
+    _close_gaps(vector_store, removed)
+
+# Drop the vectors of deleted HNSW positions from the index
+def compact_index(vector_store=None):
+    vector_store = vector_store or get_vector_store()
+    if deleted_positions:
+        removed = np.asarray(sorted(deleted_positions), dtype=np.int64)
+        deleted_positions.clear()
+        _close_gaps(vector_store, removed)
+
+# Remove the vectors of positions whose documents are gone and renumber the later ones
+def _close_gaps(vector_store, removed):
+    vector_store.index = remove_positions(vector_store.index, removed)
+    if full_vectors is not None:
+        full_vectors.remove(removed)
+
+    # later positions move down by the number of removed positions before them
+    removed_set = set(removed.tolist())
+    remaining = [doc_id for position, doc_id in sorted(vector_store.index_to_docstore_id.items())
+                 if position not in removed_set]
+    vector_store.index_to_docstore_id = dict(enumerate(remaining))
+    for filename in list(file_index):
+        kept = np.setdiff1d(np.asarray(file_index[filename], dtype=np.int64), removed)
+        if len(kept):
+            file_index[filename] = (kept - np.searchsorted(removed, kept)).tolist()
+        else:
+            del file_index[filename]
+
+# Convert the flat starter index to the configured type once there is enough data to train it well,
+# and retrain IVF indexes that outgrew their lists
+def upgrade_index():
+    vector_store = get_vector_store()
+    index = vector_store.index
+    kind = index_type(index)
+    if kind == "flat":
+        if FAISS_INDEX_TYPE == "flat" or index.ntotal < conversion_threshold(FAISS_INDEX_TYPE):
+            return False
+        kind = FAISS_INDEX_TYPE
+    elif not needs_retraining(index):
+        return False
+    # lossy indexes are retrained on the full precision vectors when they are kept
+    if full_vectors is not None:
+        vectors = to_index_vectors(full_vectors.get(np.arange(index.ntotal)))
+    else:
+        vectors = index_vectors(index)
+    new_index = build_index(kind, index.d, vectors)
+    new_index.add(vectors)
+    vector_store.index = new_index
+    return True
+
+# Convert the saved vector store to another index type
+def migrate_vector_store(new_type, path="faiss_vector_store"):
+    """Rebuilds the index as new_type from the stored vectors and saves it.
+
+    The index is truncated to EMBEDDING_TRUNCATE_DIM when it is set. The
+    full precision vectors come from the kept full vectors or, the first
+    time a store is compressed, from the index itself. A truncated index
+    without them can change its type but not its dimension.
+    Set FAISS_INDEX_TYPE to the same type so new stores are built that way too.
+    """
+    global full_vectors
+    vector_store = get_vector_store()
+    # the new index is built from the live vectors only
+    compact_index(vector_store)
+    index = vector_store.index
+    full = None
+    if full_vectors is not None:
+        full = full_vectors.get(np.arange(index.ntotal))
+    elif index.d == embedding_dim():
+        full = index_vectors(index)
+
+    if full is None:
+        vectors = index_vectors(index)
+    else:
+        dim = EMBEDDING_TRUNCATE_DIM if 0 < EMBEDDING_TRUNCATE_DIM < full.shape[1] else full.shape[1]
+        vectors = truncate_vectors(full, dim)
+    if len(vectors) < conversion_threshold(new_type):
+        print(f"Warning: {len(vectors)} vectors under-train {new_type}, its recall stays low. "
+              f"Migrate again once the store holds {conversion_threshold(new_type)} or more.")
+    new_index = build_index(new_type, vectors.shape[1], vectors)
+    new_index.add(vectors)
+    vector_store.index = new_index
+
+    full_path = os.path.join(path, os.path.basename(FULL_VECTORS_PATH))
+    if full is not None and keeps_full_vectors(new_index, new_type):
+        full_vectors = VectorFile(full_path, full.shape[1])
+        full_vectors.reset(full)
+    elif full is not None:
+        # the new index holds the full precision vectors itself
+        full_vectors = None
+        if os.path.exists(full_path):
+            os.remove(full_path)
+    vector_store.save_local(path)
+    return vector_store.index
 
 # Query the vector store
-def query_vector_store(query, k=5, filename=None):
+def query_vector_store(query, k=5, filename=None, pages=None, region_types=None, mode="vector"):
+    """Searches the whole store, or only the chunks of `filename`, of the given
+    page numbers and of the given region types ("text", "table", "figure").
 
-    results = vector_store.similarity_search_with_score(
-        query=query,
-        k=k,
-        filter={"filename": filename} if filename else None
-    )
+    "vector" ranks by embedding distance, scores are L2 distances. "lexical"
+    ranks by BM25 without embedding the query, "hybrid" fuses both rankings
+    with reciprocal rank fusion, for both higher scores are better.
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {mode}. Choose one of {SEARCH_MODES}.")
+
+    positions = None
+    if filename or pages or region_types:
+        positions = filter_positions(filename, pages, region_types)
+
+    if mode == "lexical":
+        results = lexical_search(query, k, positions)
+    elif mode == "hybrid":
+        results = hybrid_search(query, k, positions)
+    else:
+        results = search_positions(models.get("embeddings").embed_query(query), k, positions)
 
     # reverse the results
     results = results[::-1]
 
     return results
 
+# BM25 search, no embedding is computed
+def lexical_search(query, k, positions=None):
+    """Returns up to k (Document, BM25 score) pairs, best first, only of `positions` if given."""
+    vector_store = get_vector_store()
+    doc_ids = None if positions is None else [vector_store.index_to_docstore_id[p] for p in positions]
+    return [(vector_store.docstore.search(doc_id), np.float32(score))
+            for doc_id, score in lexical_index.search(query, k, doc_ids)]
+
+# Vector and BM25 rankings fused with reciprocal rank fusion
+def hybrid_search(query, k, positions=None, candidates=None):
+    """Returns up to k (Document, fused score) pairs, best first.
+
+    Each ranking contributes `candidates` results, by default 4 * k. A chunk
+    scores 1 / (RRF_K + rank) in every ranking it appears in.
+    """
+    vector_store = get_vector_store()
+    candidates = candidates or max(4 * k, 20)
+    doc_ids = None if positions is None else [vector_store.index_to_docstore_id[p] for p in positions]
+    lexical = [doc_id for doc_id, _ in lexical_index.search(query, candidates, doc_ids)]
+
+    query_vector = models.get("embeddings").embed_query(query)
+    found, _ = nearest_positions(query_vector, candidates, positions)
+    vector = [vector_store.index_to_docstore_id[int(position)] for position in found]
+
+    return [(vector_store.docstore.search(doc_id), np.float32(score))
+            for doc_id, score in reciprocal_rank_fusion([vector, lexical], k)]
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """Returns the k best (id, score) pairs of rankings given as id lists, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+# FAISS positions of the chunks matching the filters
+def filter_positions(filename=None, pages=None, region_types=None):
+    """Only the metadata of the file's chunks is checked when filename is given,
+    otherwise that of every chunk. Chunks saved without provenance have no
+    page or region type and are left out by those filters."""
+    vector_store = get_vector_store()
+    if filename:
+        positions = file_index.get(filename, [])
+    else:
+        positions = [position for position in range(vector_store.index.ntotal)
+                     if position not in deleted_positions]
+    if not pages and not region_types:
+        return list(positions)
+    pages = {pages} if isinstance(pages, int) else set(pages or [])
+    region_types = {region_types} if isinstance(region_types, str) else set(region_types or [])
+
+    matches = []
+    for position in positions:
+        metadata = vector_store.docstore.search(vector_store.index_to_docstore_id[position]).metadata
+        if pages and metadata.get("page") not in pages:
+            continue
+        if region_types and metadata.get("region_type") not in region_types:
+            continue
+        matches.append(position)
+    return matches
+
+# Search the FAISS index, only the given positions if any
+def search_positions(query_vector, k, positions=None):
+    """Returns up to k (Document, L2 distance) pairs, closest first.
+
+    With positions the cost depends on their number, not on the size of the
+    index, and k results are returned whenever there are at least k positions.
+    """
+    vector_store = get_vector_store()
+    found, distances = nearest_positions(query_vector, k, positions)
+    results = []
+    for position, distance in zip(found, distances):
+        doc_id = vector_store.index_to_docstore_id[int(position)]
+        results.append((vector_store.docstore.search(doc_id), np.float32(distance)))
+    return results
+
+# Positions and L2 distances of the k nearest vectors, among `positions` if given
+def nearest_positions(query_vector, k, positions=None):
+    """With kept full precision vectors, FAISS_RERANK_FACTOR * k candidates are
+    taken from the compressed index and re-ranked by their exact distance."""
+    query_vector = np.asarray(query_vector, dtype=np.float32)
+    if full_vectors is None or FAISS_RERANK_FACTOR <= 0:
+        return _index_positions(to_index_vectors(query_vector), k, positions)
+    found, _ = _index_positions(to_index_vectors(query_vector), k * FAISS_RERANK_FACTOR, positions)
+    return rerank(query_vector, found, full_vectors.get(found), k)
+
+def _index_positions(query_vector, k, positions=None):
+    index = get_vector_store().index
+    if positions is None:
+        live = index.ntotal - len(deleted_positions)
+        distances, found = search_excluding(index, query_vector[None, :], min(k, live) or 1, deleted_positions)
+        keep = found[0] >= 0
+        return found[0][keep], distances[0][keep]
+    if len(positions) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    ids = np.asarray(positions, dtype=np.int64)
+    k = min(k, len(ids))
+
+    # distances against the file's stored (or reconstructed) vectors
+    vectors = reconstruct_positions(index, ids)
+    all_distances = ((vectors - query_vector) ** 2).sum(axis=1)
+    order = np.argpartition(all_distances, k - 1)[:k]
+    order = order[np.argsort(all_distances[order])]
+    return ids[order], all_distances[order]
+
 # # Delete the vector store
 def reset_vector_store():
     if os.path.exists("faiss_vector_store"):
         os.remove("faiss_vector_store")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert faiss_vector_store to another index type.")
+    parser.add_argument("index_type", choices=INDEX_TYPES)
+    parser.add_argument("--truncate-dim", type=int, default=EMBEDDING_TRUNCATE_DIM,
+                        help="embedding values kept in the index, 0 keeps all")
+    args = parser.parse_args()
+    EMBEDDING_TRUNCATE_DIM = args.truncate_dim
+    index = migrate_vector_store(args.index_type)
+    print(f"faiss_vector_store is now {index_type(index)} with {index.ntotal} vectors of {index.d} dimensions")
@@ -0,0 +1,144 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+import os
+import cv2
+import numpy as np
+
+# Width of the gallery previews in pixels
+THUMBNAIL_WIDTH = 400
+
+# Shared encode/persist behaviour of the in-memory artifacts
+class Artifact:
+    def thumbnail(self, width=THUMBNAIL_WIDTH):
+        """JPEG preview scaled down to width, built once and kept on the artifact."""
+        thumbnails = self.__dict__.setdefault("_thumbnails", {})
+        if width not in thumbnails:
+            image = self._preview_image()
+            if image.shape[1] > width:
+                scale = width / image.shape[1]
+                image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            thumbnails[width] = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+        return thumbnails[width]
+
+    # Image the thumbnail is made from
+    def _preview_image(self):
+        return self.image
+
+    def to_bytes(self, ext=".png"):
+        """Encodes the artifact, e.g. for downloads or libraries that need a file."""
+        ok, buffer = cv2.imencode(ext, self.image)
+        if not ok:
+            raise ValueError(f"Could not encode {self.name} as {ext}")
+        return buffer.tobytes()
+
+    def save(self, folder):
+        """Writes the artifact to folder once and returns its path."""
+        if self.path is None:
+            os.makedirs(folder, exist_ok=True)
+            self.path = os.path.join(folder, f"{self.name}.png")
+            cv2.imwrite(self.path, self.image)
+        return self.path
+
+# In-memory handle for a page or a detected region of a page
+@dataclass(eq=False)
+class Region(Artifact):
+    """A numpy view into a page image tagged with where it came from.
+
+    Crops share memory with the page array, nothing is encoded or written to
+    disk unless save() or to_bytes() is called.
+    """
+    page: int
+    class_name: str
+    bbox: tuple
+    image: np.ndarray
+    name: str = ""
+    path: str = None
+
+# The text blocks detected on a page
+@dataclass(eq=False)
+class TextPage(Artifact):
+    """Text regions of one page in reading order.
+
+    The white page with only the text blocks pasted on it is built on first
+    access of `image`, OCR works on `regions` directly.
+    """
+    page: int
+    shape: tuple
+    regions: list = field(default_factory=list)
+    name: str = ""
+    path: str = None
+    class_name = "text"
+
+    @property
+    def bbox(self):
+        return (0, 0, self.shape[1], self.shape[0])
+
+    @cached_property
+    def image(self):
+        return self._canvas()
+
+    def _canvas(self):
+        canvas = np.full(self.shape, 255, dtype=np.uint8)
+        for region in self.regions:
+            x1, y1, x2, y2 = region.bbox
+            canvas[y1:y2, x1:x2] = region.image
+        return canvas
+
+    # a canvas built only for the thumbnail is dropped again instead of cached
+    def _preview_image(self):
+        if "image" in self.__dict__:
+            return self.image
+        return self._canvas()
+
+# Crop a region out of a page without copying the pixels
+def crop(image, page, class_name, bbox, name=""):
+    x1, y1, x2, y2 = map(int, bbox)
+    return Region(page=page,
+                  class_name=class_name,
+                  bbox=(x1, y1, x2, y2),
+                  image=image[y1:y2, x1:x2],
+                  name=name)
+
+# Sort regions column by column, each top to bottom
+def reading_order(regions):
+    """Regions wider than half the text area, like titles spanning both columns
+    of a two-column page, split the page into bands. Within a band, regions
+    whose x ranges overlap form a column, columns are read left to right."""
+    regions = sorted(regions, key=lambda region: (region.bbox[1], region.bbox[0]))
+    if not regions:
+        return regions
+    span = max(region.bbox[2] for region in regions) - min(region.bbox[0] for region in regions)
+    ordered = []
+    band = []
+    for region in regions:
+        if region.bbox[2] - region.bbox[0] > span / 2:
+            ordered.extend(_columns_order(band))
+            ordered.append(region)
+            band = []
+        else:
+            band.append(region)
+    ordered.extend(_columns_order(band))
+    return ordered
+
+def _columns_order(regions):
+    columns = []
+    for region in sorted(regions, key=lambda region: region.bbox[0]):
+        # regions sorted by x1 overlap the last column or start a new one
+        if columns and region.bbox[0] < columns[-1][0]:
+            columns[-1][0] = max(columns[-1][0], region.bbox[2])
+            columns[-1][1].append(region)
+        else:
+            columns.append([region.bbox[2], [region]])
+    return [region for _, column in columns
+            for region in sorted(column, key=lambda region: (region.bbox[1], region.bbox[0]))]
+
+# Load an artifact, path, PIL image or numpy array as a BGR array
+def load_image(obj):
+    if isinstance(obj, Artifact):
+        return obj.image
+    if isinstance(obj, np.ndarray):
+        return obj
+    if isinstance(obj, (str, os.PathLike)):
+        return cv2.imread(str(obj))
+    # PIL image from pdf2image
+    return cv2.cvtColor(np.asarray(obj.convert("RGB")), cv2.COLOR_RGB2BGR)
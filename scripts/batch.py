@@ -0,0 +1,220 @@
+"""Process a directory or manifest of PDFs and images without the Streamlit app.
+
+Every document goes through the same steps as in the app: detection, OCR,
+table extraction, saving the text and tables to Postgres and adding the
+chunked text regions and table rows to the vector store. Finished documents are recorded in a state
+file, so an interrupted run picks up where it stopped. A document that was
+interrupted halfway is processed again from the start, its text and tables replace
+the rows saved by the interrupted run.
+
+Run from the project root:
+    python -m scripts.batch docs/ --workers 2
+    python -m scripts.batch --manifest nightly.txt --state nightly_state.json --summary nightly.json
+"""
+from dotenv import load_dotenv
+import argparse
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config.metrics as metrics
+import config.vector_db_config as vdb
+import scripts.cache as cache
+import scripts.chunking as chunking
+import scripts.handle_files as hfiles
+import scripts.pipeline as pipeline
+import scripts.extract_text as etxt
+import scripts.extract_tables as etables
+
+load_dotenv()
+
+DOCUMENT_TYPES = (".pdf", ".png", ".jpg", ".jpeg")
+# Number of documents processed at the same time
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 2))
+BATCH_STATE_PATH = os.getenv("BATCH_STATE_PATH", "batch_state.json")
+
+# List the documents of directories, files and a manifest with one path per line
+def find_documents(inputs, manifest=None):
+    documents = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in sorted(os.walk(path)):
+                documents.extend(os.path.join(root, file) for file in sorted(files)
+                                 if file.lower().endswith(DOCUMENT_TYPES))
+        else:
+            documents.append(path)
+    if manifest:
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    documents.append(line)
+    # keep the first occurrence of every document
+    return list(dict.fromkeys(os.path.abspath(document) for document in documents))
+
+def load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# Write the state file atomically so an interruption never leaves it half written
+def save_state(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+@contextlib.contextmanager
+def _timed(timings, step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[step] = round(time.perf_counter() - start, 3)
+
+# Run one document through the pipeline, everything except the vector store
+def process_document(path, output_dir=None, save_db=True, **options):
+    """Returns (summary, vector store chunks) of the document.
+
+    The stages of the document run concurrently in scripts.pipeline, the
+    timings are the seconds each stage spent working. With `output_dir` the
+    detected regions are written to output_dir/<file name>. Tables are saved as
+    <file name>_<n>_<title> so documents do not overwrite each other's tables.
+    """
+    file_name = os.path.basename(path)
+    stem = os.path.splitext(file_name)[0]
+    result = pipeline.process_document(path, save_db=save_db, table_prefix=f"{stem}_", **options)
+    if output_dir:
+        hfiles.save_artifacts(os.path.join(output_dir, stem), result.annotated_images, result.texts,
+                              result.tables, result.figures)
+
+    stats = result.stats
+    timings = {step: stats[stage]["busy"] for step, stage in
+               [("detect", "detect"), ("ocr", "ocr"), ("tables", "tables"), ("persist", "persist")]}
+    if save_db:
+        timings["persist"] = round(timings["persist"] + stats["save_text"], 3)
+    timings["wall"] = stats["wall"]
+
+    summary = {
+        "file": path,
+        "pages": len(result.texts),
+        "text_regions": sum(len(page.regions) for page in result.texts),
+        "characters": len(result.text),
+        "tables": len(result.tables),
+        "tables_extracted": sum(df is not None for df in result.table_data),
+        "figures": len(result.figures),
+        "table_names": [name for name, df in zip(result.table_names, result.table_data) if df is not None],
+        "timings": timings,
+        "stages": {name: stage for name, stage in stats.items() if isinstance(stage, dict)},
+    }
+    # the chunks hold only text, the page images are freed once the result goes
+    return summary, list(chunking.iter_chunks(result.segments()))
+
+# Process the documents concurrently, skipping the ones finished in an earlier run
+def run_batch(documents, workers=BATCH_WORKERS, state_path=BATCH_STATE_PATH, add_vectors=True, **options):
+    """Returns the summaries of the documents processed in this run.
+
+    Documents run in `workers` threads. The OCR and table stage workers are
+    split between them, unless given in `options`. Vector store additions
+    happen in the calling thread, one document at a time.
+    """
+    state = load_state(state_path) if state_path else {}
+    options.setdefault("ocr_workers", max(1, etxt.OCR_WORKERS // workers))
+    options.setdefault("table_workers", max(1, etables.TABLE_WORKERS // workers))
+
+    summaries = []
+    todo = {}
+    for path in documents:
+        try:
+            doc_hash = cache.file_hash(path)
+        except OSError as e:
+            summaries.append({"file": path, "status": "failed", "error": f"{type(e).__name__}: {e}"})
+            continue
+        entry = state.get(path)
+        if entry and entry.get("status") == "done" and entry.get("hash") == doc_hash:
+            print(f"Skipping {path}, already processed")
+            continue
+        todo[path] = doc_hash
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(metrics.in_context(process_document), path, **options): path for path in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary, chunks = future.result()
+                if add_vectors:
+                    with _timed(summary["timings"], "vectors"):
+                        vdb.add_chunks_to_vector_store(vdb.document_key(path), chunks)
+                summary["timings"]["total"] = round(summary["timings"].pop("wall") + summary["timings"].get("vectors", 0), 3)
+                summary["status"] = "done"
+            except Exception as e:
+                summary = {"file": path, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+            summary["hash"] = todo[path]
+            summaries.append(summary)
+            print(f"{summary['status']}: {path}")
+            if state_path:
+                state[path] = summary
+                save_state(state_path, state)
+            metrics.save()
+    return summaries
+
+STEPS = ["detect", "ocr", "tables", "persist", "vectors", "total"]
+
+def print_summary(summaries):
+    print(f"{'file':<40} {'status':<7} {'pages':>5} {'tables':>6} {'figures':>7} "
+          + " ".join(f"{step:>8}" for step in STEPS))
+    for summary in summaries:
+        timings = summary.get("timings", {})
+        print(f"{os.path.basename(summary['file'])[:40]:<40} {summary['status']:<7} "
+              f"{summary.get('pages', 0):>5} {summary.get('tables', 0):>6} {summary.get('figures', 0):>7} "
+              + " ".join(f"{timings[step]:>8.2f}" if step in timings else f"{'-':>8}" for step in STEPS))
+    for summary in summaries:
+        if summary["status"] == "failed":
+            print(f"{summary['file']}: {summary['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="PDF/image files or directories to process")
+    parser.add_argument("--manifest", help="text file with one document path per line")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="documents processed at the same time")
+    parser.add_argument("--state", default=BATCH_STATE_PATH, help="state file used to resume, '' to disable")
+    parser.add_argument("--summary", help="write the per-document summary as JSON to this file")
+    parser.add_argument("--output-dir", help="also write the detected regions below this folder")
+    parser.add_argument("--no-db", action="store_true", help="do not save text and tables to Postgres")
+    parser.add_argument("--no-vectors", action="store_true", help="do not add the data to the vector store")
+    parser.add_argument("--implicit-rows", action="store_true")
+    parser.add_argument("--implicit-columns", action="store_true")
+    parser.add_argument("--borderless-tables", action="store_true")
+    args = parser.parse_args()
+
+    documents = find_documents(args.inputs, args.manifest)
+    if not documents:
+        parser.error("no documents found")
+
+    start = time.perf_counter()
+    metrics.start_run(f"batch_{time.strftime('%Y%m%d_%H%M%S')}")
+    summaries = run_batch(documents,
+                          workers=args.workers,
+                          state_path=args.state or None,
+                          add_vectors=not args.no_vectors,
+                          output_dir=args.output_dir,
+                          save_db=not args.no_db,
+                          implicit_rows=args.implicit_rows,
+                          implicit_columns=args.implicit_columns,
+                          borderless_tables=args.borderless_tables)
+    print_summary(summaries)
+    print(f"{len(summaries)} documents in {time.perf_counter() - start:.1f}s")
+    metrics.save()
+    print(f"Metrics written to {metrics.METRICS_DIR}")
+
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
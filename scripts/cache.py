@@ -0,0 +1,114 @@
+from dotenv import load_dotenv
+import hashlib
+import numpy as np
+import os
+import pickle
+import threading
+
+load_dotenv()
+
+# Location and size cap of the persistent result cache
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", 2048)) * 1024 * 1024
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") != "0"
+
+_lock = threading.Lock()
+_size = None
+_file_hashes = {}
+
+# Build a cache key from any number of parts
+def make_key(*parts):
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+# Hash the content of a file, e.g. an uploaded document or the model weights
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Hash of a file that does not change while the process runs
+def model_checksum(path):
+    if path not in _file_hashes:
+        _file_hashes[path] = file_hash(path)
+    return _file_hashes[path]
+
+# Hash the pixels of an image array
+def array_hash(array):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr((array.shape, array.dtype.str)).encode("utf-8"))
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+def _path(kind, key):
+    return os.path.join(CACHE_DIR, kind, key[:2], f"{key}.pkl")
+
+# Read a cached value, touching it so eviction is least recently used
+def get(kind, key, default=None):
+    if not CACHE_ENABLED:
+        return default
+    path = _path(kind, key)
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+        os.utime(path)
+        return value
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return default
+
+# Store a value and evict the oldest entries if the cache is over its cap
+def put(kind, key, value):
+    global _size
+    if not CACHE_ENABLED:
+        return
+    path = _path(kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with _lock:
+        # an overwritten entry no longer counts towards the size
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(tmp_path, path)
+        if _size is None:
+            _size = _disk_usage()
+        else:
+            _size += os.path.getsize(path) - old_size
+        if _size > CACHE_MAX_BYTES:
+            _size = evict(CACHE_MAX_BYTES)
+
+def _entries():
+    for root, _, files in os.walk(CACHE_DIR):
+        for file in files:
+            if file.endswith(".pkl"):
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+def _disk_usage():
+    return sum(size for _, size, _ in _entries())
+
+# Delete least recently used entries until the cache fits in max_bytes
+def evict(max_bytes=CACHE_MAX_BYTES):
+    """Returns the cache size after eviction."""
+    entries = sorted(_entries())
+    size = sum(size for _, size, _ in entries)
+    # leave some headroom so eviction does not run on every put
+    target = int(max_bytes * 0.9)
+    for _, entry_size, path in entries:
+        if size <= target:
+            break
+        try:
+            os.remove(path)
+            size -= entry_size
+        except FileNotFoundError:
+            pass
+    return size
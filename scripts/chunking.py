@@ -0,0 +1,189 @@
+from dotenv import load_dotenv
+import csv
+import functools
+import io
+import os
+import re
+from dataclasses import dataclass
+from config.vector_db_config import EMBEDDING_MODEL
+
+load_dotenv()
+
+# Longest chunk in tokens of the embedding model
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 512))
+# Tokens repeated from the end of a text chunk at the start of the next one
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 64))
+
+# Rough characters per token when tiktoken is not available
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# A piece of text and where it came from
+@dataclass
+class Segment:
+    """A text region, a table row or a paragraph of edited text.
+
+    `header` is repeated at the start of every chunk built from the segment,
+    e.g. the column names of a table. Pages are numbered from 1, `page` and
+    `bbox` are None when the position is not known.
+    """
+    text: str
+    page: int = None
+    region_type: str = "text"
+    bbox: tuple = None
+    header: str = ""
+
+# A piece of text sized for the embedding model
+@dataclass
+class Chunk:
+    text: str
+    page: int
+    region_type: str
+    bbox: tuple
+    tokens: int
+
+    @property
+    def metadata(self):
+        return {"page": self.page, "region_type": self.region_type, "bbox": self.bbox}
+
+# Tokenizer of the embedding model, None when tiktoken or its vocabulary can't be loaded
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # the vocabulary is downloaded on first use, offline setups estimate from the length
+        print(f"Counting tokens by length, tiktoken is not available: {e}")
+        return None
+
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+# Cut text into pieces of at most max_tokens, at token boundaries
+def _split_tokens(text, max_tokens):
+    encoding = _encoding()
+    if encoding is None:
+        size = max_tokens * CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+# Sentences of a segment, sentences longer than max_tokens are cut
+def _pieces(text, max_tokens):
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            yield sentence, tokens
+        else:
+            for piece in _split_tokens(sentence, max_tokens):
+                yield piece, count_tokens(piece)
+
+def _union(boxes):
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return None
+    return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+# Pack segments into chunks of at most max_tokens
+def iter_chunks(segments, max_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """Yields Chunks as the segments come in, only the chunk being built is kept.
+
+    Consecutive segments of the same page and region type share a chunk
+    while they fit, a chunk never spans two pages, region types or tables. Its
+    bbox is the union of the regions it covers. Text chunks start with up to
+    `overlap` tokens of the sentences before them, table chunks with the
+    header instead. Token counts leave out the separators, so they are a
+    close estimate.
+    """
+    key = None
+    # (separator, text, tokens, bbox) of the pieces in the current chunk
+    parts = []
+    used = 0
+
+    def chunk():
+        text = "".join(separator + piece for separator, piece, _, _ in parts).lstrip()
+        if key[2]:
+            text = f"{key[2]}\n{text}"
+        return Chunk(text=text, page=key[0], region_type=key[1], bbox=_union(part[3] for part in parts),
+                     tokens=used)
+
+    for segment in segments:
+        # rows of two tables are never mixed, even with the same columns
+        segment_key = (segment.page, segment.region_type, segment.header, segment.bbox if segment.header else None)
+        if segment_key != key:
+            if parts:
+                yield chunk()
+            key = segment_key
+            parts = []
+            header_tokens = count_tokens(segment.header) if segment.header else 0
+            budget = max(max_tokens - header_tokens, 1)
+            used = header_tokens
+
+        separator = "\n" if segment.header else "\n\n"
+        for piece, tokens in _pieces(segment.text, budget):
+            if parts and used + tokens > max_tokens:
+                yield chunk()
+                # carry the last sentences over, tables repeat the header instead
+                carried = []
+                carried_tokens = 0
+                if not segment.header:
+                    for part in reversed(parts):
+                        if carried_tokens + part[2] > min(overlap, budget - tokens):
+                            break
+                        carried.insert(0, part)
+                        carried_tokens += part[2]
+                parts = carried
+                used = header_tokens + carried_tokens
+            parts.append((separator, piece, tokens, segment.bbox))
+            used += tokens
+            separator = " "
+    if parts:
+        yield chunk()
+
+# Text regions of the OCR'd pages
+def page_segments(texts, page_blocks):
+    """`texts` are the TextPages, `page_blocks` the OCR text of each page's
+    regions. Pages OCR'd as a whole have one block with the page's bbox."""
+    for text_page, blocks in zip(texts, page_blocks):
+        if len(blocks) == len(text_page.regions):
+            boxes = [region.bbox for region in text_page.regions]
+        else:
+            boxes = [text_page.bbox] * len(blocks)
+        for block, bbox in zip(blocks, boxes):
+            if block.strip():
+                yield Segment(text=block, page=text_page.page, bbox=bbox)
+
+# Paragraphs of a text whose regions are not known, e.g. after editing
+def text_segments(text, page=None):
+    for paragraph in re.split(r"\n\s*\n", text):
+        if paragraph.strip():
+            yield Segment(text=paragraph, page=page)
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow(values)
+    return buffer.getvalue()
+
+# One segment per row, with the column names as header
+def table_segments(regions, tables, region_type="table"):
+    """`regions` are the detected table or figure regions, `tables` their
+    DataFrames (None when nothing was extracted)."""
+    for region, df in zip(regions, tables):
+        if df is None:
+            continue
+        header = _csv_line(df.columns)
+        for row in df.itertuples(index=False):
+            yield Segment(text=_csv_line(row), page=region.page, region_type=region_type,
+                          bbox=region.bbox, header=header)
@@ -1,118 +1,130 @@
 import cv2
 from img2table.document import Image
 from img2table.ocr import TesseractOCR
-import pandas as pd
-import re
 import os
-import streamlit as st
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import config.db_config as db
+import config.metrics as metrics
+import scripts.cache as cache
+import scripts.table_data as tdata
+from scripts.artifacts import Region, load_image
 
-def extract_table_data(tables, implicit_rows, implicit_columns, borderless_tables):
-    """Extracts table data from the images using img2table."""
-    ocr = TesseractOCR(n_threads=4, lang="eng")
-    title = []
-    data = []
-    for table in tables:
-        table_image = Image(src=table)
-        extracted_data = table_image.extract_tables(ocr=ocr, 
-                                                implicit_rows=implicit_rows,
-                                                implicit_columns=implicit_columns,
-                                                borderless_tables=borderless_tables)
-        if len(extracted_data) == 0:
-            table_title = ""
-            table_data = ""
+# Number of table extraction worker processes
+TABLE_WORKERS = int(os.getenv("TABLE_WORKERS", os.cpu_count() or 1))
+
+# OCR engine of the current thread, pipeline threads and worker processes each build their own
+_local = threading.local()
+
+def _init_ocr(n_threads=1):
+    _local.ocr = TesseractOCR(n_threads=n_threads, lang="eng")
+    return _local.ocr
+
+def _get_ocr(n_threads=1):
+    ocr = getattr(_local, "ocr", None)
+    return ocr if ocr is not None else _init_ocr(n_threads)
+
+# Extract the first table of a single image, runs inside the worker processes
+def extract_table(src, implicit_rows, implicit_columns, borderless_tables):
+    """Returns (title, DataFrame) of the table found in src, a path or encoded image."""
+    table_image = Image(src=src)
+    extracted_data = table_image.extract_tables(ocr=_get_ocr(), 
+                                            implicit_rows=implicit_rows,
+                                            implicit_columns=implicit_columns,
+                                            borderless_tables=borderless_tables)
+    if len(extracted_data) == 0:
+        table_title = ""
+        table_data = None
+    else:
+        if extracted_data[0].title is None:
+            table_title = "Table"
         else:
-            if extracted_data[0].title is None:
-                table_title = "Table"
-            else:
-                table_title = extracted_data[0].title.replace("\n", "_").replace(" ", "_").replace(".", "")
-            table_title = table_title[:63]
-            table_data = extracted_data[0].df
-            table_data.columns = table_data.iloc[0]
-            table_data = table_data[1:]
-            table_data.columns = [str(col) + "  " for col in table_data.columns]
-            table_data = table_data.map(lambda x: str(x) + "  ")
-            table_data = table_data.to_string(index=False)
-
-        title.append(table_title)
-        data.append(table_data)
-    return title, data
+            table_title = tdata.clean_name(extracted_data[0].title)
+        table_data = tdata.from_extracted(extracted_data[0].df)
+    return table_title, table_data
 
-# process the table data
-def process_table_data(table_name, table_data):
-    
-    if len(table_data) == 0:
-        return table_name, None
-    
-    # Given table name
-    table_name = table_name.replace("\n", "_").replace(" ", "_").replace(".", "")
-    # cut the table name to 63 characters
-    table_name = table_name[:63]
-    
-    # Given table string
-    table_data = table_data
+# Extract the tables in parallel and yield them as they finish
+@metrics.instrument("extract_table_data", item="tables")
+def iter_table_data(tables, implicit_rows, implicit_columns, borderless_tables, workers=TABLE_WORKERS,
+                    ocr_threads=1):
+    """Yields (table index, title, data) in completion order.
 
-    # Convert table string into a structured list
-    lines = table_data.split("\n")
-    parsed_data = [re.split(r"\s{2,}", line.strip()) for line in lines]
+    Tables extracted in the calling thread use an OCR engine with `ocr_threads`
+    threads, keep it at 1 when the caller itself runs in parallel.
+    """
+    pending = {}
+    for i, table in enumerate(tables):
+        key = cache.make_key(cache.array_hash(load_image(table)), "dataframe",
+                             implicit_rows, implicit_columns, borderless_tables)
+        cached = cache.get("tables", key)
+        if cached is not None:
+            yield i, cached[0], cached[1]
+        else:
+            # img2table only reads files or encoded bytes, BMP is the cheapest to encode
+            src = table.to_bytes(".bmp") if isinstance(table, Region) else table
+            pending[i] = (key, src)
 
-    # Extract column headers and rows
-    headers = parsed_data[0]  # Use the first row as headers
-    data_rows = parsed_data[1:]  # Remaining rows
+    if workers <= 1 or len(pending) <= 1:
+        if pending:
+            _get_ocr(n_threads=ocr_threads)
+        for i, (key, src) in pending.items():
+            result = extract_table(src, implicit_rows, implicit_columns, borderless_tables)
+            cache.put("tables", key, result)
+            yield i, result[0], result[1]
+        return
 
-    # Handle duplicate headers
-    headers = [f"{header}_{i}" if headers.count(header) > 1 else header for i, header in enumerate(headers)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_ocr) as executor:
+        futures = {executor.submit(extract_table, src, implicit_rows, implicit_columns, borderless_tables): i
+                   for i, (_, src) in pending.items()}
+        for future in as_completed(futures):
+            i = futures[future]
+            result = future.result()
+            cache.put("tables", pending[i][0], result)
+            yield i, result[0], result[1]
 
-    # Create a DataFrame from the extracted data
-    df = pd.DataFrame(data_rows, columns=headers)
+def extract_table_data(tables, implicit_rows, implicit_columns, borderless_tables, workers=TABLE_WORKERS):
+    """Extracts table data from the images using img2table."""
+    # a single table is extracted in this thread, its OCR may use the idle workers' cores
+    results = {i: (table_title, table_data)
+               for i, table_title, table_data in iter_table_data(tables, implicit_rows, implicit_columns,
+                                                                 borderless_tables, workers=workers,
+                                                                 ocr_threads=min(max(workers, 1), 4))}
+    title = [results[i][0] for i in range(len(results))]
+    data = [results[i][1] for i in range(len(results))]
+    return title, data
 
-    # Replace "None" string with actual None values
-    df.replace("None", None, inplace=True)
+# Extract a single table in the calling thread, used by the pipeline stages
+def extract_table_region(table, implicit_rows, implicit_columns, borderless_tables):
+    """Returns (title, DataFrame) of the table.
 
-    return table_name, df
+    The pipeline runs TABLE_WORKERS of these at once, so each OCR engine gets one thread.
+    """
+    _, title, data = next(iter_table_data([table], implicit_rows, implicit_columns, borderless_tables, workers=1))
+    return title, data
+
+# process the table data
+def process_table_data(table_name, table_data):
+    """Returns the cleaned table name and the table as a DataFrame."""
+    if table_data is None or len(table_data) == 0:
+        return tdata.clean_name(table_name), None
+    return tdata.clean_name(table_name), table_data
 
 def read_data(file_path, file_name):
-    if file_path.endswith(".csv"):
-        table_data = pd.read_csv(file_path)
-    elif file_path.endswith(".xlsx"):
-        table_data = pd.read_excel(file_path)
-    else:
-        raise ValueError("Invalid file format. Please provide a CSV or Excel file.")
-    
     # Given table name
-    table_name = file_name.split(".")[0]
-    table_name = table_name.replace("\n", "_").replace(" ", "_").replace(".", "")
-    table_name = table_name[:63]
-    
-    # Handle data
-    table_data = table_data.fillna("None")
-    # round the float columns
-    for col in table_data.select_dtypes(include=["float"]).columns:
-        table_data[col] = table_data[col].round(2)
-    # Convert all columns to string for visualization
-    table_data.columns = [str(col) + "  " for col in table_data.columns]
-    table_data = table_data.map(lambda x: str(x) + "  ")
-    table_data = table_data.to_string(index=False)
-
-    return table_name, table_data
+    table_name = tdata.clean_name(file_name.split(".")[0])
+    return table_name, tdata.from_file(file_path)
 
 def download_csv(table_name, table_df):
     name, df = process_table_data(table_name, table_df)
-    df = pd.DataFrame(df)
-    csv_dest = f"upload/res/{name}.csv"
-    df.to_csv(csv_dest, index=False)
-    csv = df.to_csv(index=False).encode("utf-8")
+    csv = tdata.to_text(df).encode("utf-8")
     return name, csv
 
-def save_table(table_name, table_df):
+def save_table(table_name, table_df, schema=None, if_exists="append"):
     """Save table to database."""
     name, df = process_table_data(table_name, table_df)
-    db.create_table_from_df(name, df)
+    if df is not None:
+        db.create_table_from_df(name, df, schema=schema, if_exists=if_exists)
 
-def delete_table(table_name):
+def delete_table(table_name, folder):
     """Deletes the table file."""
-    csv_dest = f"upload/res/{table_name}.csv"
-    try:
-        os.remove(csv_dest)
-    except FileNotFoundError:
-        pass
\ No newline at end of file
+    tdata.delete_parquet(table_name, folder=folder)
@@ -1,33 +1,137 @@
 from dotenv import load_dotenv
 import os
-import cv2
+import functools
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pytesseract
-import spacy.cli
 import re
-import spacy
 import pandas as pd
 import config.db_config as db
+import scripts.cache as cache
+import config.model_registry as models
+import config.metrics as metrics
+from scripts.artifacts import TextPage, load_image
 
 load_dotenv()
 
 # Set the path to the Tesseract executable
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
-# Download the English model for spaCy
+# Load the English model for spaCy on first use
 # spacy.cli.download("en_core_web_sm")
-nlp = spacy.load("en_core_web_sm")
+def load_nlp():
+    import spacy
+    return spacy.load("en_core_web_sm")
+
+models.register("nlp", load_nlp)
+
+# Number of OCR worker processes
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+
+# "region" OCRs the detected text blocks, "page" OCRs the whole masked page
+OCR_MODE = os.getenv("OCR_MODE", "region")
+
+# Tesseract config for a single block of text
+REGION_OCR_CONFIG = "--psm 6"
+
+# OCR a single image, runs inside the worker processes
+def ocr_page(page_img, config=""):
+    return pytesseract.image_to_string(page_img, config=config)
+
+# Split the pages into OCR tasks of (page index, image, config)
+def _ocr_tasks(pages, mode):
+    for i, page in enumerate(pages):
+        if mode == "region" and isinstance(page, TextPage):
+            for region in page.regions:
+                yield i, region.image, REGION_OCR_CONFIG
+        else:
+            yield i, load_image(page), ""
+
+# OCR the pages in parallel and yield them as they finish
+@metrics.instrument("extract_text", item="pages")
+def iter_text(pages, workers=OCR_WORKERS, mode=OCR_MODE, join=True):
+    """Yields (page index, text) pairs in completion order.
+
+    In region mode every text block is a separate task, a page is yielded once
+    all of its blocks are done and the blocks are joined in reading order.
+    Pages without text blocks are yielded as empty strings. With join=False
+    the text is the list of block texts instead, one per region in region mode.
+    """
+    pages = list(pages)
+    tasks = []
+    block_counts = [0] * len(pages)
+    for i, image, config in _ocr_tasks(pages, mode):
+        tasks.append((i, block_counts[i], image, config))
+        block_counts[i] += 1
+    blocks = [[None] * count for count in block_counts]
+    remaining = list(block_counts)
+    metrics.count(regions=len(tasks))
+
+    for i, count in enumerate(block_counts):
+        if count == 0:
+            yield i, join_blocks([], mode) if join else []
+
+    for (i, j, _, _), text in _run_ocr(tasks, workers):
+        blocks[i][j] = text
+        remaining[i] -= 1
+        if remaining[i] == 0:
+            yield i, join_blocks(blocks[i], mode) if join else blocks[i]
+
+# Run the OCR tasks and yield (task, text) as they finish
+def _run_ocr(tasks, workers):
+    # cached blocks are returned right away, keyed by pixels and OCR settings
+    pending = {}
+    for task in tasks:
+        key = cache.make_key(cache.array_hash(task[2]), task[3], _tesseract_version())
+        text = cache.get("ocr", key)
+        if text is None:
+            pending[key] = task
+        else:
+            yield task, text
+
+    if workers <= 1:
+        for key, task in pending.items():
+            text = ocr_page(task[2], task[3])
+            cache.put("ocr", key, text)
+            yield task, text
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(ocr_page, task[2], task[3]): key for key, task in pending.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            text = future.result()
+            cache.put("ocr", key, text)
+            yield pending[key], text
+
+@functools.lru_cache(maxsize=None)
+def _tesseract_version():
+    return str(pytesseract.get_tesseract_version())
+
+def join_blocks(blocks, mode=OCR_MODE):
+    if not blocks:
+        return ""
+    if mode == "region":
+        return "\n\n".join(block.strip() for block in blocks if block.strip()) + "\n\n"
+    return "".join(blocks)
+
+# OCR a single page in the calling thread, used by the pipeline stages
+def ocr_text_page(page, mode=OCR_MODE):
+    return join_blocks(ocr_text_blocks(page, mode), mode)
+
+# Text of each region of a single page, in the calling thread
+def ocr_text_blocks(page, mode=OCR_MODE):
+    return dict(iter_text([page], workers=1, mode=mode, join=False))[0]
 
 # Extract text from the images
-def extract_text(pages):
+def extract_text(pages, workers=OCR_WORKERS, mode=OCR_MODE):
     """Extracts text from a PDF by converting it to images and applying OCR."""
-    
-    text_data = ""
+    page_text = dict(iter_text(pages, workers=workers, mode=mode))
 
-    for page in pages:
-        page_img = cv2.imread(page)
-        text_data += pytesseract.image_to_string(page_img)
-        
-    return text_data
+    # join the pages once, in page order
+    return "".join(page_text[i] for i in range(len(page_text)))
 
 # clean the extracted text
 def clean_text(text):
@@ -45,21 +149,57 @@ def clean_text(text):
 
     return text
 
+# NER settings, paragraphs are sent to spaCy in batches
+NER_BATCH_SIZE = int(os.getenv("NER_BATCH_SIZE", 64))
+NER_PROCESSES = int(os.getenv("NER_PROCESSES", 1))
+# longest piece of text handed to spaCy at once
+NER_MAX_CHARS = 5000
+# number of texts whose entities are kept in memory
+NER_CACHE_SIZE = 32
+
+_entity_cache = OrderedDict()
+_entity_cache_lock = threading.Lock()
+
+# Split text into paragraphs, long paragraphs are cut at sentence ends
+def split_paragraphs(text, max_chars=NER_MAX_CHARS):
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(". ", 0, max_chars) + 1 or paragraph.rfind(" ", 0, max_chars) + 1 or max_chars
+            yield paragraph[:cut].rstrip()
+            paragraph = paragraph[cut:].strip()
+        if paragraph:
+            yield paragraph
+
 # ner the extracted text
-def extract_entities(text):
-    doc = nlp(text)
-    entities = [(ent.text, ent.label_) for ent in doc.ents]
+@metrics.instrument("extract_entities")
+def extract_entities(text, n_process=NER_PROCESSES, batch_size=NER_BATCH_SIZE):
+    """Returns a DataFrame of Entity, Label and Count, memoized by text hash."""
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    with _entity_cache_lock:
+        if key in _entity_cache:
+            _entity_cache.move_to_end(key)
+            return _entity_cache[key].copy()
 
-    # make a data frame
-    entities_df = pd.DataFrame()
-    entities_df["Entity"] = [ent[0] for ent in entities]
-    entities_df["Label"] = [ent[1] for ent in entities]
+    # run only the entity recognizer over the paragraphs
+    nlp = models.get("nlp")
+    disable = [name for name in nlp.pipe_names if name != "ner"]
+    counts = Counter()
+    paragraphs = 0
+    for doc in nlp.pipe(split_paragraphs(text), batch_size=batch_size, n_process=n_process, disable=disable):
+        counts.update((ent.text, ent.label_) for ent in doc.ents)
+        paragraphs += 1
+    metrics.count(paragraphs=paragraphs, entities=len(counts))
 
-    # add a column for the count of each entity type
-    entities_df["Count"] = entities_df.groupby(["Entity", "Label"])["Entity"].transform("count")
-    entities_df = entities_df.drop_duplicates()
+    # make a data frame with the count of each entity
+    entities_df = pd.DataFrame([(entity, label, count) for (entity, label), count in counts.items()],
+                               columns=["Entity", "Label", "Count"])
 
-    return entities_df
+    with _entity_cache_lock:
+        _entity_cache[key] = entities_df
+        if len(_entity_cache) > NER_CACHE_SIZE:
+            _entity_cache.popitem(last=False)
+    return entities_df.copy()
 
 # process the extracted text
 def process_text(text_data):
@@ -78,46 +218,46 @@ def split_text(text, chunk_size=10000):
     return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
 
 # save the processed text
-def save_text(file_name, text):
-    """Save text and its embedding to PostgreSQL"""
-
-    connection, engine = db.create_connection()
-    cursor = connection.cursor()
-
-
-    # create table if not exists
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS texts (
-            id SERIAL PRIMARY KEY,
-            filename TEXT
-        );
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS pdf_text_chunks (
-            id SERIAL PRIMARY KEY,
-            texts_id INTEGER REFERENCES texts(id) ON DELETE CASCADE,
-            chunk_order INTEGER,
-            content TEXT
-        );
-    """)
-
-    # insert the text
-    cursor.execute("""
-        INSERT INTO texts (filename)
-        VALUES (%s)
-        RETURNING id;
-    """, (file_name,))
-    text_id = cursor.fetchone()[0]
-
-    # split the text into chunks
-    text_chunks = split_text(text)
-    for i, chunk in enumerate(text_chunks):
+@metrics.instrument("save_text")
+def save_text(file_name, text, schema=None, replace=False):
+    """Save text and its embedding to PostgreSQL, in `schema` if given.
+    With `replace` the text saved earlier for file_name is deleted first."""
+
+    with db.connection(schema=schema) as connection:
+        cursor = connection.cursor()
+
+        # create table if not exists
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS texts (
+                id SERIAL PRIMARY KEY,
+                filename TEXT
+            );
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pdf_text_chunks (
+                id SERIAL PRIMARY KEY,
+                texts_id INTEGER REFERENCES texts(id) ON DELETE CASCADE,
+                chunk_order INTEGER,
+                content TEXT
+            );
+        """)
+
+        # the chunks of the old text go with it
+        if replace:
+            cursor.execute("DELETE FROM texts WHERE filename = %s;", (file_name,))
+
+        # insert the text
         cursor.execute("""
-            INSERT INTO pdf_text_chunks (texts_id, chunk_order, content)
-            VALUES (%s, %s, %s);
-        """, (text_id, i, chunk))
+            INSERT INTO texts (filename)
+            VALUES (%s)
+            RETURNING id;
+        """, (file_name,))
+        text_id = cursor.fetchone()[0]
 
-    connection.commit()
-    cursor.close()
-    connection.close()
\ No newline at end of file
+        # split the text into chunks
+        text_chunks = split_text(text)
+        db.copy_rows(cursor, "pdf_text_chunks", ["texts_id", "chunk_order", "content"],
+                     ((text_id, i, chunk) for i, chunk in enumerate(text_chunks)))
+        metrics.count(chunks=len(text_chunks))
+        cursor.close()
@@ -1,15 +1,23 @@
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import cv2
-import numpy as np
 import supervision as sv
-from ultralytics import YOLO
 from dotenv import load_dotenv
 import os
+import queue
+import threading
+import scripts.cache as cache
+import config.model_registry as models
+import config.metrics as metrics
+from scripts.artifacts import Region, TextPage, crop, load_image, reading_order
 
 load_dotenv()
 
-# load the YOLO11 model
-model = YOLO(os.getenv("YOLO_MODEL_PATH"))
+# load the YOLO11 model on first use
+def load_model():
+    from ultralytics import YOLO
+    return YOLO(os.getenv("YOLO_MODEL_PATH"))
+
+models.register("yolo", load_model)
 
 # Function to save uploaded file
 def save_uploaded_file(uploaded_file, save_path):
@@ -17,70 +25,222 @@ def save_uploaded_file(uploaded_file, save_path):
         f.write(uploaded_file.getbuffer())
     return save_path
 
-# Function to split PDF into images
-def split_pdf(pdf_path):
-    pages = convert_from_path(pdf_path, 200)
-    page_files = []
-    for i, page in enumerate(pages):
-        page_path = f"upload/img/pages/page_{i+1}.png"
-        page.save(page_path, "PNG")
-        page_files.append(page_path)
-    return page_files
+# Function to split PDF into images, written to output_folder, e.g. Job.pages_dir
+def split_pdf(pdf_path, output_folder, dpi=200, window=8):
+    return list(iter_pdf_pages(pdf_path, dpi=dpi, window=window, output_folder=output_folder))
+
+# Rasterize the PDF in bounded page windows and yield pages as they are ready
+def iter_pdf_pages(pdf_path, dpi=200, window=8, paths_only=True, output_folder=None, prefetch=1):
+    """Yields the pages of a PDF one at a time.
+
+    Only `window` pages are rendered by poppler at once, so peak memory does not
+    grow with the page count. With `paths_only` the pages are written to
+    `output_folder`, the job's Job.pages_dir, as page_{n}.png and their paths
+    are yielded, otherwise the BGR page arrays are yielded and kept in the
+    result cache, keyed by the document hash, page number and DPI.
+
+    Pages are rendered on a background thread up to `prefetch` windows ahead
+    of the caller, so rendering the next window overlaps the detection of the
+    current one. prefetch=0 renders in the calling thread.
+    """
+    if paths_only:
+        if output_folder is None:
+            raise ValueError("paths_only needs the output_folder of the job, e.g. Job.pages_dir")
+        os.makedirs(output_folder, exist_ok=True)
+    pages = _render_pages(pdf_path, dpi, window, paths_only, output_folder)
+    if prefetch <= 0:
+        yield from pages
+    else:
+        yield from _prefetch(pages, window * prefetch)
+
+# Pull items from a generator on a background thread, at most `size` ahead
+def _prefetch(items, size):
+    ready = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        # give up once the consumer is gone, instead of blocking on a full queue
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    break
+            else:
+                put((False, None))
+        except BaseException as e:
+            put((False, e))
+        finally:
+            items.close()
+
+    thread = threading.Thread(target=metrics.in_context(produce), daemon=True)
+    thread.start()
+    try:
+        while True:
+            more, item = ready.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+@metrics.instrument("split_pdf", item="pages")
+def _render_pages(pdf_path, dpi, window, paths_only, output_folder):
+    page_count = pdfinfo_from_path(pdf_path)["Pages"]
+    doc_hash = None if paths_only else cache.file_hash(pdf_path)
+    for first_page in range(1, page_count + 1, window):
+        last_page = min(first_page + window - 1, page_count)
+        if not paths_only:
+            keys = [cache.make_key(doc_hash, n, dpi) for n in range(first_page, last_page + 1)]
+            cached = [cache.get("pages", key) for key in keys]
+            if all(page is not None for page in cached):
+                for page in cached:
+                    yield cv2.imdecode(page, cv2.IMREAD_COLOR)
+                continue
+
+        if paths_only:
+            rendered = convert_from_path(pdf_path, dpi,
+                                         first_page=first_page,
+                                         last_page=last_page,
+                                         output_folder=output_folder,
+                                         fmt="png",
+                                         paths_only=True)
+            for i, rendered_path in enumerate(rendered):
+                page_path = os.path.join(output_folder, f"page_{first_page + i}.png")
+                os.replace(rendered_path, page_path)
+                yield page_path
+        else:
+            rendered = convert_from_path(pdf_path, dpi,
+                                         first_page=first_page,
+                                         last_page=last_page)
+            for key, page in zip(keys, rendered):
+                image = load_image(page)
+                # low PNG compression, decoding the cached page must stay cheaper than rendering it
+                cache.put("pages", key, cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 1])[1])
+                yield image
+            # free the window before rendering the next one
+            del rendered
+
+# Run the layout model over the pages in batches
+@metrics.instrument("detect_text", item="pages")
+def detect_layout(pages, model=None, batch_size=8, conf=0.35, iou=0.7, device=None):
+    """Yields (image, detections) for every page, in page order.
+
+    `pages` can be any iterable of paths, PIL images or numpy arrays, including
+    the iter_pdf_pages generator. Pages are pulled lazily and sent to the model
+    `batch_size` at a time.
+    """
+    model = model or models.get("yolo")
+    model_key = _model_key(model)
+    batch = []
+    for page in pages:
+        batch.append(load_image(page))
+        if len(batch) == batch_size:
+            yield from _detect_batch(batch, model, model_key, conf, iou, device)
+            batch = []
+    if batch:
+        yield from _detect_batch(batch, model, model_key, conf, iou, device)
+
+# Checksum of the model weights, part of the detection cache key
+def _model_key(model):
+    weights = getattr(model, "ckpt_path", None) or os.getenv("YOLO_MODEL_PATH")
+    if weights and os.path.exists(weights):
+        return cache.model_checksum(weights)
+    return type(model).__name__
+
+def _detect_batch(images, model, model_key, conf, iou, device):
+    # only send pages without cached detections to the model
+    keys = [cache.make_key(cache.array_hash(image), model_key, conf, iou) for image in images]
+    detections = [cache.get("detections", key) for key in keys]
+    missing = [i for i, found in enumerate(detections) if found is None]
+    if missing:
+        results = model([images[i] for i in missing], conf=conf, iou=iou, device=device)
+        for i, result in zip(missing, results):
+            # stand-in models, e.g. in the benchmarks, may return detections directly
+            detections[i] = result if isinstance(result, sv.Detections) else sv.Detections.from_ultralytics(result)
+            cache.put("detections", keys[i], detections[i])
+    yield from zip(images, detections)
 
 # detect text, table, and figure using YOLOv11 model
-def detect_text(pages, model=model):
+def detect_text(pages, model=None, batch_size=8, output_dir=None):
+    """Returns the annotated pages, text pages, tables and figures as artifacts.
+
+    Text, table and figure regions are views into the page arrays. When `output_dir`
+    is given every artifact is also written below it, otherwise nothing
+    touches the disk.
+    """
     annotated_images = []
     texts = []
     tables = []
     figures = []
-    for j, page in enumerate(pages):
-        image = cv2.imread(page)
-        results = model(image, conf=0.35, iou=0.7)[0]
-        detections = sv.Detections.from_ultralytics(results)
-
-        # save annotated image
-        annotated_image = image.copy()
-        annotated_image = sv.BoxAnnotator().annotate(scene=annotated_image, detections=detections)
-        annotated_image = sv.LabelAnnotator().annotate(scene=annotated_image, detections=detections)
-        output_image_path = f"upload/img/annotated/page_{j+1}_annotated.png"
-        cv2.imwrite(output_image_path, annotated_image)
-        annotated_images.append(output_image_path)
-
-        # make a white image with the same size as the original image
-        image_copy = np.ones_like(image) * 255
-
-        # Iterate through detections and process sections
-        for i, class_name in enumerate(detections.data['class_name']):
-            if class_name == 'text':
-                # Extract bounding box coordinates
-                x1, y1, x2, y2 = map(int, detections.xyxy[i])
-
-                # Extract the section
-                section = image[y1:y2, x1:x2]
-
-                # copy the text section to the white image
-                image_copy[y1:y2, x1:x2] = section
-
-            elif class_name in ['table', 'figure']:
-                # Extract bounding box coordinates
-                x1, y1, x2, y2 = map(int, detections.xyxy[i])
-
-                # Extract the section
-                section = image[y1:y2, x1:x2]
-
-                # Save the extracted section
-                output_filename = f"upload/img/{class_name}s/page_{j+1}_{class_name}_{i}.png"
-                cv2.imwrite(output_filename, section)
-
-                # Append the section to the list of tables or figures
-                if class_name == 'table':
-                    tables.append(output_filename)
-                elif class_name == 'figure':
-                    figures.append(output_filename)
-                
-        # Save the modified image
-        output_image_path = f"upload/img/texts/page_{j+1}_text.png"
-        cv2.imwrite(output_image_path, image_copy)
-        texts.append(output_image_path)
-
-    return annotated_images, texts, tables, figures
\ No newline at end of file
+    for j, (image, detections) in enumerate(detect_layout(pages, model=model, batch_size=batch_size)):
+        annotated_image, text_page, page_tables, page_figures = page_artifacts(j+1, image, detections)
+        annotated_images.append(annotated_image)
+        texts.append(text_page)
+        tables.extend(page_tables)
+        figures.extend(page_figures)
+
+    if output_dir is not None:
+        save_artifacts(output_dir, annotated_images, texts, tables, figures)
+
+    return annotated_images, texts, tables, figures
+
+# Split one detected page into its annotated image, text page, tables and figures
+@metrics.instrument("page_artifacts")
+def page_artifacts(page, image, detections):
+    height, width = image.shape[:2]
+
+    # annotated image
+    annotated_image = image.copy()
+    annotated_image = sv.BoxAnnotator().annotate(scene=annotated_image, detections=detections)
+    annotated_image = sv.LabelAnnotator().annotate(scene=annotated_image, detections=detections)
+    annotated_image = Region(page=page,
+                             class_name="annotated",
+                             bbox=(0, 0, width, height),
+                             image=annotated_image,
+                             name=f"page_{page}_annotated")
+
+    # Iterate through detections and process sections
+    text_regions = []
+    tables = []
+    figures = []
+    for i, class_name in enumerate(detections.data['class_name']):
+        if class_name == 'text':
+            # Extract the text block as a view into the page
+            text_regions.append(crop(image, page, class_name, detections.xyxy[i],
+                                     name=f"page_{page}_text_{i}"))
+
+        elif class_name in ['table', 'figure']:
+            # Extract the section as a view into the page
+            section = crop(image, page, class_name, detections.xyxy[i],
+                           name=f"page_{page}_{class_name}_{i}")
+
+            # Append the section to the list of tables or figures
+            if class_name == 'table':
+                tables.append(section)
+            elif class_name == 'figure':
+                figures.append(section)
+
+    text_page = TextPage(page=page,
+                         shape=image.shape,
+                         regions=reading_order(text_regions),
+                         name=f"page_{page}_text")
+    metrics.count(regions=len(text_regions) + len(tables) + len(figures))
+    return annotated_image, text_page, tables, figures
+
+# Persist the artifacts in the upload/img layout
+def save_artifacts(output_dir, annotated_images, texts, tables, figures):
+    for folder, regions in [("annotated", annotated_images), ("texts", texts),
+                            ("tables", tables), ("figures", figures)]:
+        for region in regions:
+            region.save(os.path.join(output_dir, folder))
@@ -0,0 +1,124 @@
+from dotenv import load_dotenv
+import os
+import shutil
+import time
+from uuid import uuid4
+import config.db_config as db
+
+load_dotenv()
+
+# Folder holding one workspace per job
+JOBS_DIR = os.getenv("JOBS_DIR", "upload/jobs")
+# Jobs without activity for this long are removed when a new job starts
+JOB_TTL_HOURS = float(os.getenv("JOB_TTL_HOURS", 24))
+
+JOB_DIRECTORIES = ["files", "res", "img/pages", "img/annotated", "img/texts", "img/tables", "img/figures"]
+
+# A workspace folder and a database schema owned by one session
+class Job:
+    """Everything a job writes lives below its folder and in its Postgres
+    schema, so jobs running side by side do not clobber each other's files
+    or tables. cleanup() removes both.
+
+    Liveness is tracked with a heartbeat file, touched on every use, and the
+    id of the session owning the job.
+    """
+
+    def __init__(self, job_id, root=JOBS_DIR):
+        self.id = job_id
+        self.dir = os.path.join(root, job_id)
+        self.schema = f"job_{job_id}"
+
+    def path(self, *parts):
+        return os.path.join(self.dir, *parts)
+
+    # Where an uploaded file is saved
+    def upload_path(self, file_name):
+        return self.path("files", os.path.basename(file_name))
+
+    # Folder of the job's Parquet tables
+    @property
+    def res_dir(self):
+        return self.path("res")
+
+    # Folder the job's rasterized PDF pages are written to
+    @property
+    def pages_dir(self):
+        return self.path("img", "pages")
+
+    # Create the workspace folders and the schema, existing ones are kept
+    def create(self):
+        for directory in JOB_DIRECTORIES:
+            os.makedirs(self.path(directory), exist_ok=True)
+        db.create_schema(self.schema)
+
+    # Mark the job as in use, so it is not removed as stale
+    def touch(self):
+        """A workspace removed in the meantime is created again, empty."""
+        if not os.path.isdir(self.dir):
+            self.create()
+        with open(self.path("heartbeat"), "a"):
+            pass
+        os.utime(self.path("heartbeat"))
+
+    # Time of the last touch, the folder's mtime for jobs without a heartbeat
+    def last_seen(self):
+        try:
+            return os.path.getmtime(self.path("heartbeat"))
+        except FileNotFoundError:
+            return os.path.getmtime(self.dir)
+
+    # Record the session that owns the job, e.g. the Streamlit session id
+    def claim(self, owner):
+        with open(self.path("owner"), "w", encoding="utf-8") as f:
+            f.write(owner)
+
+    def owner(self):
+        try:
+            with open(self.path("owner"), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    # Empty the workspace folders, keeping the job and its tables
+    def clear_files(self):
+        for directory in JOB_DIRECTORIES:
+            folder = self.path(directory)
+            for file in os.listdir(folder):
+                os.remove(os.path.join(folder, file))
+
+    # Remove the workspace and drop the job's schema with all its tables
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        db.drop_schema(self.schema)
+
+# Start a job with an empty workspace and schema
+def create_job(root=JOBS_DIR, owner=None, is_active=None):
+    """`owner` and `is_active` are passed on to Job.claim and cleanup_stale_jobs."""
+    job = Job(uuid4().hex[:12], root)
+    job.create()
+    if owner:
+        job.claim(owner)
+    job.touch()
+    cleanup_stale_jobs(root=root, is_active=is_active)
+    return job
+
+# Remove the jobs nobody touched within max_age_hours
+def cleanup_stale_jobs(max_age_hours=JOB_TTL_HOURS, root=JOBS_DIR, is_active=None):
+    """Jobs for which is_active(job) is true are kept however long they were
+    idle, e.g. those of Streamlit sessions that are still open. Returns the
+    ids of the removed jobs."""
+    removed = []
+    if not os.path.isdir(root):
+        return removed
+    cutoff = time.time() - max_age_hours * 3600
+    for job_id in os.listdir(root):
+        job = Job(job_id, root)
+        try:
+            if job.last_seen() >= cutoff or (is_active is not None and is_active(job)):
+                continue
+            job.cleanup()
+            removed.append(job_id)
+        except Exception as e:
+            print(f"Could not remove job {job_id}: {e}")
+    return removed
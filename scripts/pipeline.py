@@ -0,0 +1,299 @@
+from dotenv import load_dotenv
+import os
+import itertools
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import config.metrics as metrics
+import scripts.chunking as chunking
+import scripts.handle_files as hfiles
+import scripts.extract_text as etxt
+import scripts.extract_tables as etables
+import scripts.table_data as tdata
+from scripts.artifacts import load_image
+
+load_dotenv()
+
+# Items waiting in front of each stage, a full queue blocks the stage feeding it
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+DETECT_BATCH_SIZE = int(os.getenv("DETECT_BATCH_SIZE", 8))
+
+_STOP = object()
+
+# The YOLO predictor is not thread-safe, pipelines take turns in the detection step
+_detect_lock = threading.Lock()
+
+class _Stopped(Exception):
+    pass
+
+# A step of the pipeline with its own worker threads and input queue
+class Stage:
+    """Runs fn(batch, emit) in `workers` threads.
+
+    A worker takes one item from the queue and, when batch_size > 1, whatever
+    else is already waiting up to batch_size items. fn hands its results on
+    with emit(stage name, item), or emit(None, item) for a pipeline output.
+    """
+
+    def __init__(self, name, fn, workers=1, batch_size=1, queue_size=PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.items = 0
+        # seconds spent working and waiting for room in the next stage's queue
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {"workers": self.workers, "items": self.items,
+                "busy": round(self.busy, 3), "blocked": round(self.blocked, 3)}
+
+# Stages connected by bounded queues
+class Pipeline:
+    """Runs the stages concurrently until every emitted item is processed.
+
+    Bounded queues give backpressure, a stage that gets ahead blocks until the
+    stage after it catches up. The first exception raised by a stage stops
+    the pipeline and is raised from run().
+    """
+
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        self.outputs = []
+        self.wall = 0.0
+        self._pending = 0
+        self._done = threading.Condition()
+        self._error = None
+        self._stop = threading.Event()
+        self._local = threading.local()
+
+    # Hand an item to a stage, blocking while its queue is full
+    def emit(self, stage_name, item):
+        if stage_name is None:
+            self.outputs.append(item)
+            return
+        stage = self.stages[stage_name]
+        with self._done:
+            self._pending += 1
+        start = time.perf_counter()
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                stage.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        if hasattr(self._local, "blocked"):
+            self._local.blocked += time.perf_counter() - start
+
+    def _take(self, stage):
+        while True:
+            if self._stop.is_set():
+                return None
+            try:
+                item = stage.queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+        if item is _STOP:
+            return None
+        batch = [item]
+        while len(batch) < stage.batch_size:
+            try:
+                item = stage.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # leave the stop marker for the worker that owns it
+                stage.queue.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self, stage):
+        while True:
+            batch = self._take(stage)
+            if batch is None:
+                return
+            self._local.blocked = 0.0
+            start = time.perf_counter()
+            try:
+                stage.fn(batch, self.emit)
+            except _Stopped:
+                return
+            except BaseException as e:
+                with self._done:
+                    self._error = self._error or e
+                    self._done.notify_all()
+                self._stop.set()
+                return
+            elapsed = time.perf_counter() - start
+            with stage._lock:
+                stage.items += len(batch)
+                stage.busy += elapsed - self._local.blocked
+                stage.blocked += self._local.blocked
+            with self._done:
+                self._pending -= len(batch)
+                if self._pending == 0:
+                    self._done.notify_all()
+
+    # Feed the items to the first stage and wait until all stages are done
+    def run(self, stage_name, items):
+        """Returns the items emitted as outputs, in completion order."""
+        # the workers report into the metrics run of the caller
+        threads = [threading.Thread(target=metrics.in_context(self._work), args=(stage,), name=f"{stage.name}-{i}",
+                                    daemon=True)
+                   for stage in self.stages.values() for i in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        finished = False
+        try:
+            for item in items:
+                self.emit(stage_name, item)
+            with self._done:
+                while self._pending and self._error is None:
+                    self._done.wait()
+            finished = self._error is None
+        except _Stopped:
+            pass
+        finally:
+            if finished:
+                for stage in self.stages.values():
+                    for _ in range(stage.workers):
+                        stage.queue.put(_STOP)
+            else:
+                self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.wall = time.perf_counter() - start
+
+        if self._error is not None:
+            raise self._error
+        return self.outputs
+
+    def stats(self):
+        stats = {name: stage.stats() for name, stage in self.stages.items()}
+        stats["wall"] = round(self.wall, 3)
+        return stats
+
+# Everything extracted from one document
+@dataclass
+class DocumentResult:
+    file: str
+    annotated_images: list = field(default_factory=list)
+    texts: list = field(default_factory=list)
+    tables: list = field(default_factory=list)
+    figures: list = field(default_factory=list)
+    page_text: list = field(default_factory=list)
+    page_blocks: list = field(default_factory=list)
+    table_names: list = field(default_factory=list)
+    table_data: list = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+    @property
+    def text(self):
+        return "".join(self.page_text)
+
+    # Text regions and table rows with their page and bbox, for the chunker
+    def segments(self):
+        return itertools.chain(chunking.page_segments(self.texts, self.page_blocks),
+                               chunking.table_segments(self.tables, self.table_data))
+
+# Run a document through rasterize -> detect -> OCR / tables -> persist
+def process_document(path, extract_tables=True, save_db=False, table_prefix="", schema=None,
+                     ocr_workers=etxt.OCR_WORKERS, table_workers=etables.TABLE_WORKERS,
+                     implicit_rows=False, implicit_columns=False, borderless_tables=False,
+                     dpi=200, batch_size=DETECT_BATCH_SIZE, queue_size=PIPELINE_QUEUE_SIZE):
+    """Returns a DocumentResult with the artifacts, text and tables in page order.
+
+    Page N is OCR'd and its tables extracted while page N+1 is being detected.
+    With `save_db` every table is saved as soon as it is extracted and the text
+    once all pages are done, in `schema` if given. Tables are named <table_prefix><n>_<title> when a
+    prefix is given. The text and the prefixed tables replace what an earlier
+    run saved for the document, so processing it again does not duplicate rows.
+    """
+    result = DocumentResult(file=path)
+    page_blocks = {}
+    tables = {}
+    # tables are numbered in page order, the single detect worker sees the pages in order
+    table_number = {}
+
+    def rasterize(batch, emit):
+        for path in batch:
+            if path.lower().endswith(".pdf"):
+                pages = hfiles.iter_pdf_pages(path, dpi=dpi, paths_only=False)
+            else:
+                pages = [load_image(path)]
+            for i, image in enumerate(pages):
+                emit("detect", (i + 1, image))
+
+    def detect(batch, emit):
+        with _detect_lock:
+            detected = list(hfiles.detect_layout([image for _, image in batch], batch_size=len(batch)))
+        for (page, _), (image, detections) in zip(batch, detected):
+            annotated_image, text_page, page_tables, page_figures = hfiles.page_artifacts(page, image, detections)
+            emit(None, (page, annotated_image, text_page, page_tables, page_figures))
+            emit("ocr", text_page)
+            for i, table in enumerate(page_tables):
+                table_number[(page, i)] = len(table_number) + 1
+                if extract_tables:
+                    emit("tables", ((page, i), table))
+
+    def ocr(batch, emit):
+        for text_page in batch:
+            page_blocks[text_page.page] = etxt.ocr_text_blocks(text_page)
+
+    def extract(batch, emit):
+        for key, table in batch:
+            title, df = etables.extract_table_region(table, implicit_rows, implicit_columns, borderless_tables)
+            tables[key] = (title, df)
+            if save_db and df is not None:
+                emit("persist", (key, title, df))
+
+    def persist(batch, emit):
+        for key, title, df in batch:
+            # prefixed names belong to this document, unprefixed ones collect the tables of every document
+            etables.save_table(_table_name(key, title), df, schema=schema,
+                               if_exists="replace" if table_prefix else "append")
+
+    def _table_name(key, title):
+        if not table_prefix:
+            return title
+        return tdata.clean_name(f"{table_prefix}{table_number[key]}_{title}")
+
+
+    pipeline = Pipeline([
+        Stage("rasterize", rasterize, queue_size=1),
+        Stage("detect", detect, batch_size=batch_size, queue_size=queue_size),
+        Stage("ocr", ocr, workers=ocr_workers, queue_size=queue_size),
+        Stage("tables", extract, workers=table_workers, queue_size=queue_size),
+        Stage("persist", persist, queue_size=queue_size),
+    ])
+    outputs = pipeline.run("rasterize", [path])
+
+    for page, annotated_image, text_page, page_tables, page_figures in sorted(outputs, key=lambda item: item[0]):
+        result.annotated_images.append(annotated_image)
+        result.texts.append(text_page)
+        result.tables.extend(page_tables)
+        result.figures.extend(page_figures)
+    result.page_blocks = [page_blocks[text_page.page] for text_page in result.texts]
+    result.page_text = [etxt.join_blocks(blocks) for blocks in result.page_blocks]
+    for key in sorted(tables):
+        title, df = tables[key]
+        result.table_names.append(_table_name(key, title))
+        result.table_data.append(df)
+
+    if save_db:
+        start = time.perf_counter()
+        etxt.save_text(os.path.basename(path), result.text, schema=schema, replace=True)
+        result.stats["save_text"] = round(time.perf_counter() - start, 3)
+    result.stats.update(pipeline.stats())
+    return result
@@ -0,0 +1,90 @@
+import io
+import os
+import pandas as pd
+
+# Table names are used as Postgres identifiers
+def clean_name(name):
+    name = str(name).replace("\n", "_").replace(" ", "_").replace(".", "")
+    # cut the name to 63 characters
+    return name[:63]
+
+# Make repeated column names unique
+def dedupe_columns(columns):
+    columns = [str(col) for col in columns]
+    return [f"{col}_{i}" if columns.count(col) > 1 else col for i, col in enumerate(columns)]
+
+# Give columns that only hold numbers a numeric dtype
+def infer_types(df):
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            try:
+                df[col] = pd.to_numeric(df[col])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+# Turn an img2table frame, whose first row holds the headers, into a table
+def from_extracted(df):
+    df = df.copy()
+    df.columns = dedupe_columns(df.iloc[0])
+    df = df.iloc[1:].reset_index(drop=True)
+    return infer_types(df.replace({"": None}))
+
+# Read a CSV/Excel file as a table
+def from_file(file_path):
+    if file_path.endswith(".csv"):
+        df = pd.read_csv(file_path)
+    elif file_path.endswith(".xlsx"):
+        df = pd.read_excel(file_path)
+    else:
+        raise ValueError("Invalid file format. Please provide a CSV or Excel file.")
+    df.columns = dedupe_columns(df.columns)
+    # round the float columns
+    for col in df.select_dtypes(include=["float"]).columns:
+        df[col] = df[col].round(2)
+    return df
+
+# Editable text view of a table
+def to_text(df):
+    if df is None:
+        return ""
+    return df.to_csv(index=False)
+
+# Parse an edited text view back into a table
+def from_text(text):
+    """Raises ValueError when the text is not valid CSV."""
+    if not text.strip():
+        return None
+    df = pd.read_csv(io.StringIO(text))
+    df.columns = dedupe_columns(df.columns)
+    return df
+
+# Apply an edit of the text view, parsing only when the text changed
+def apply_edit(df, text, edited_text):
+    """Returns the (table, text view) after the edit."""
+    if edited_text == text:
+        return df, text
+    return from_text(edited_text), edited_text
+
+# Keep a table on disk as Parquet, in the folder of the job it belongs to, e.g. Job.res_dir
+def save_parquet(name, df, folder):
+    if df is None:
+        return None
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{clean_name(name)}.parquet")
+    df = df.copy()
+    # Parquet needs one type per column, mixed object columns are stored as text
+    for col in df.select_dtypes(include=["object"]).columns:
+        df[col] = df[col].map(lambda value: None if pd.isna(value) else str(value))
+    df.to_parquet(path, index=False)
+    return path
+
+def load_parquet(name, folder):
+    return pd.read_parquet(os.path.join(folder, f"{clean_name(name)}.parquet"))
+
+def delete_parquet(name, folder):
+    try:
+        os.remove(os.path.join(folder, f"{clean_name(name)}.parquet"))
+    except FileNotFoundError:
+        pass